@@ -0,0 +1,98 @@
+"""Micro-benchmark: per-chapter CPU time of the HTML cleanup stage.
+
+Compares the old multi-pass cleanup (ftfy over the whole document, then
+BeautifulSoup parse/serialize for image rewriting, then another BeautifulSoup
+parse and ftfy pass for body extraction) with the single lxml tree pass in
+``services.clean_chapter_html``. Image downloads are replaced with a no-op so
+only parsing/cleanup CPU time is measured.
+
+Usage (from src/backend):
+    python benchmarks/bench_cleanup.py [--paragraphs 2000] [--images 60] [--rounds 5]
+"""
+import os
+import sys
+import html
+import time
+import argparse
+import tempfile
+
+# Ensure we can import from the backend directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ftfy
+from bs4 import BeautifulSoup
+from readability import Document
+
+import services
+
+
+def make_article(paragraphs: int, images: int) -> str:
+    """A long blog-style page with some mojibake and lots of images."""
+    parts = ["<html><head><title>Bench</title></head><body><article><h2>A long read</h2>"]
+    every = max(1, paragraphs // max(images, 1))
+    for i in range(paragraphs):
+        parts.append(
+            f"<p>Paragraph {i}: the cafÃ© opened at dawn — "
+            f"“quoted” text, <a href='/p/{i}'>a link</a> and <em>emphasis</em>. "
+            + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4
+            + "</p>"
+        )
+        if i % every == 0 and i // every < images:
+            parts.append(f"<figure><img src='/img/{i}.jpg' alt='Figure {i}'><figcaption>Fig {i}</figcaption></figure>")
+    parts.append("</article></body></html>")
+    return "".join(parts)
+
+
+def legacy_cleanup(main_html: str, title: str, base_url: str, temp_dir: str) -> str:
+    """The pre-lxml pipeline: repair_unicode -> localize_images -> normalize_to_book_html."""
+    wrapped = f"<html><head><meta charset='utf-8'></head><body>{main_html}</body></html>"
+    wrapped = ftfy.fix_text(wrapped)
+
+    soup = BeautifulSoup(wrapped, "html.parser")
+    for img in soup.find_all("img"):
+        if img.get("src"):
+            img["src"] = "images/stub.jpg"
+    localized = str(soup)
+
+    soup = BeautifulSoup(localized, "html.parser")
+    body = soup.find("body")
+    content = ftfy.fix_text(str(body) if body else localized)
+    return f"<h1>{html.escape(title)}</h1>\n<div>{content}</div>"
+
+
+def cpu_time(fn, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.process_time()
+        fn()
+        best = min(best, time.process_time() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--images", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # No network: every image "downloads" instantly to the same local name
+    services.localize_image_url = lambda abs_url, images_dir, *a, **kw: "stub.jpg"
+
+    page = make_article(args.paragraphs, args.images)
+    main_html = Document(page).summary(html_partial=True)
+    print(f"Article: {len(page) / 1024:.0f} KiB raw, {len(main_html) / 1024:.0f} KiB after readability, "
+          f"{args.images} images")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy = cpu_time(lambda: legacy_cleanup(main_html, "Bench", "http://bench.local/", temp_dir), args.rounds)
+        single = cpu_time(lambda: services.clean_chapter_html(main_html, "Bench", "http://bench.local/", temp_dir), args.rounds)
+
+    print(f"{'pipeline':<24}{'CPU ms / chapter':>18}")
+    print(f"{'legacy (bs4 + ftfy x2)':<24}{legacy * 1000:>18.1f}")
+    print(f"{'single lxml tree':<24}{single * 1000:>18.1f}")
+    print(f"Reduction: {(1 - single / legacy) * 100:.0f}% ({legacy / single:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""End-to-end, offline benchmark of the book pipeline.
+
+Starts the local fixture server (``fixture_server.py``), builds books of 1, 10,
+50 and 200 chapters through ``generate_book_pdf`` and/or the HTTP endpoints,
+and reports per-stage wall time, CPU time, peak RSS and PDF size. Each book
+size runs in a fresh subprocess with an empty cache directory, built twice:
+``cold`` (nothing cached) and ``warm`` (same process, caches populated).
+
+Per-stage numbers come from ``BuildProgress`` stage transitions (``chapters``
+covers fetch, cleanup, image localization and the cover; ``rendering`` covers
+WeasyPrint and PDF assembly), plus the cumulative time spent inside the main
+pipeline functions across all worker threads. With RENDER_WORKERS > 0 the
+WeasyPrint CPU time and memory are spent in the render worker processes and
+are not part of the reported CPU time and peak RSS; set RENDER_WORKERS=0 to
+measure the whole pipeline in one process.
+
+Usage (from src/backend):
+    python benchmarks/bench_pipeline.py [--chapters 1 10 50 200] [--via function pdf-endpoint]
+    python benchmarks/bench_pipeline.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --baseline benchmarks/baseline.json [--tolerance 0.25]
+
+With ``--baseline`` the run exits non-zero if cold wall time, CPU time or peak
+RSS of any book regresses by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import resource
+import tempfile
+import functools
+import subprocess
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Ensure we can import from the backend directory
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_server import FixtureServer
+
+VIAS = ("function", "pdf-endpoint", "json-endpoint")
+# Functions whose cumulative time is reported, by pipeline stage
+TIMED_FUNCTIONS = {
+    "fetch": "fetch_clean",
+    "clean": "clean_chapter_html",
+    "image_download": "download_image_fast",
+    "render": "render_fragments",
+    "render_single": "render_document",
+    "assemble": "assemble_pdf",
+}
+# Compared against the baseline, for the cold build
+REGRESSION_METRICS = ("wall_s", "cpu_s", "peak_rss_mb")
+
+
+def book_data(base_url: str, chapters: int) -> dict:
+    return {
+        "title": f"Benchmark Book {chapters}",
+        "subtitle": "Offline fixture run",
+        "author": "Benchmark",
+        "format": "PDF",
+        "coverImage": {"url": f"{base_url}/cover.jpg", "name": "Cover"},
+        "coverOptions": {"layout": "center", "fontFamily": "serif"},
+        "chapters": [
+            {
+                "id": str(n),
+                "title": f"Chapter {n + 1}",
+                "description": "",
+                "url": f"{base_url}/post/{n}",
+            }
+            for n in range(chapters)
+        ],
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+# --- Child: one book size, measured in its own process ---
+
+def instrument(services):
+    """Patches ``services`` to record stage transitions and per-function time."""
+    marks = []
+    totals = {stage: {"seconds": 0.0, "calls": 0} for stage in TIMED_FUNCTIONS}
+    lock = threading.Lock()
+
+    class TimedProgress(services.BuildProgress):
+        def start(self, stage, total=0):
+            marks.append((stage, time.perf_counter(), time.process_time()))
+            super().start(stage, total)
+
+    services.BuildProgress = TimedProgress
+
+    def timed(stage, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with lock:
+                    totals[stage]["seconds"] += time.perf_counter() - started
+                    totals[stage]["calls"] += 1
+        return wrapper
+
+    for stage, name in TIMED_FUNCTIONS.items():
+        setattr(services, name, timed(stage, getattr(services, name)))
+    return marks, totals
+
+
+def make_builder(via: str):
+    """Returns ``build(book) -> pdf size in bytes`` for the chosen entry point."""
+    if via == "function":
+        from services import generate_book_pdf
+
+        def build(book):
+            result = generate_book_pdf(book)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error"))
+            return len(base64.b64decode(result["content"]))
+        return build, None
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    client = TestClient(app)
+    client.__enter__()
+    path = "/generate-book/pdf" if via == "pdf-endpoint" else "/generate-book/"
+
+    def build(book):
+        resp = client.post(path, json={"book": book})
+        if resp.status_code != 200:
+            raise RuntimeError(f"{path} returned {resp.status_code}: {resp.text[:200]}")
+        if via == "pdf-endpoint":
+            return len(resp.content)
+        return len(base64.b64decode(resp.json()["content"]))
+    return build, client
+
+
+def run_child(args) -> dict:
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import services
+    marks, totals = instrument(services)
+    build, client = make_builder(args.via)
+    book = book_data(args.fixtures, args.chapters)
+
+    runs = {}
+    try:
+        for phase in ("cold", "warm"):
+            marks.clear()
+            for stage in totals.values():
+                stage.update(seconds=0.0, calls=0)
+
+            started_wall, started_cpu = time.perf_counter(), time.process_time()
+            error, size = None, None
+            try:
+                size = build(book)
+            except Exception as e:
+                error = str(e)
+            ended_wall, ended_cpu = time.perf_counter(), time.process_time()
+
+            stages = {}
+            timeline = marks + [("end", ended_wall, ended_cpu)]
+            for (stage, wall, cpu), (_, next_wall, next_cpu) in zip(timeline, timeline[1:]):
+                stages[stage] = {"wall_s": round(next_wall - wall, 3), "cpu_s": round(next_cpu - cpu, 3)}
+
+            runs[phase] = {
+                "wall_s": round(ended_wall - started_wall, 3),
+                "cpu_s": round(ended_cpu - started_cpu, 3),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+                "pdf_bytes": size,
+                "stages": stages,
+                "functions": {stage: {"seconds": round(t["seconds"], 3), "calls": t["calls"]}
+                              for stage, t in totals.items() if t["calls"]},
+                "error": error,
+            }
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+    return runs
+
+
+# --- Parent: fixture server, one subprocess per book size, report ---
+
+def run_case(chapters: int, via: str, fixtures: str) -> dict:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, BOOK_CACHE_DIR=cache_dir)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--chapters", str(chapters), "--via", via, "--fixtures", fixtures],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+        )
+    if proc.returncode != 0:
+        return {"cold": {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "child failed"}}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_report(results: dict) -> None:
+    print(f"{'case':<22}{'phase':<6}{'wall s':>9}{'cpu s':>9}{'rss MB':>9}{'pdf KiB':>10}  stages (wall/cpu s)")
+    for case, runs in results.items():
+        for phase, run in runs.items():
+            if run.get("error"):
+                print(f"{case:<22}{phase:<6}  error: {run['error']}")
+                continue
+            stages = "  ".join(f"{name} {s['wall_s']:.2f}/{s['cpu_s']:.2f}" for name, s in run["stages"].items())
+            print(f"{case:<22}{phase:<6}{run['wall_s']:>9.2f}{run['cpu_s']:>9.2f}{run['peak_rss_mb']:>9.0f}"
+                  f"{(run['pdf_bytes'] or 0) / 1024:>10.0f}  {stages}")
+            functions = "  ".join(f"{name} {f['seconds']:.2f}s/{f['calls']}"
+                                  for name, f in run["functions"].items())
+            print(f"{'':<28}in-function (all threads): {functions}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions of the cold build against ``baseline``, as readable lines."""
+    regressions = []
+    for case, runs in results.items():
+        base = baseline.get("results", {}).get(case, {}).get("cold")
+        run = runs.get("cold", {})
+        if not base or base.get("error"):
+            continue
+        if run.get("error"):
+            regressions.append(f"{case}: failed ({run['error']})")
+            continue
+        for metric in REGRESSION_METRICS:
+            if base.get(metric) and run[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{case}: {metric} {base[metric]} -> {run[metric]} "
+                                   f"(+{(run[metric] / base[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--via", nargs="+", choices=VIAS, default=["function", "pdf-endpoint"])
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--fixtures", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.via, args.chapters = args.via[0], args.chapters[0]
+        print(json.dumps(run_child(args)))
+        return
+
+    results = {}
+    with FixtureServer(args.port) as server:
+        for via in args.via:
+            for chapters in args.chapters:
+                case = f"{via}/{chapters}ch"
+                print(f"Running {case}...", file=sys.stderr)
+                results[case] = run_case(chapters, via, server.base_url)
+
+    print_report(results)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Local HTTP fixture server with canned blog pages and images, for offline benchmarks.
+
+Routes:
+    /post/<n>          blog-style article n (deterministic; ETag/304 supported)
+    /img/<size>/<n>    JPEG image n at ``small`` (480px), ``medium`` (1400px) or
+                       ``large`` (3200px) width; every n has distinct bytes
+    /cover.jpg         a cover-sized image
+
+Usage (from src/backend):
+    python benchmarks/fixture_server.py [--port 8799]
+"""
+import re
+import time
+import hashlib
+import argparse
+import multiprocessing
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+IMAGE_WIDTHS = {"small": 480, "medium": 1400, "large": 3200}
+# Images per article, by size; a typical long-form post
+ARTICLE_IMAGES = ("small", "medium", "medium", "large")
+ARTICLE_PARAGRAPHS = 60
+
+_images: dict[str, bytes] = {}
+
+
+def base_image(size: str) -> bytes:
+    """A photo-like JPEG (gradient plus noise) of the given size, built once."""
+    if size not in _images:
+        from PIL import Image, ImageDraw, ImageFilter
+
+        width = IMAGE_WIDTHS[size]
+        height = width * 2 // 3
+        img = Image.effect_noise((width, height), 48).convert("RGB")
+        draw = ImageDraw.Draw(img, "RGBA")
+        for x in range(0, width, max(1, width // 64)):
+            draw.line([(x, 0), (x, height)], fill=(x * 255 // width, 90, 160, 96), width=max(1, width // 64))
+        img = img.filter(ImageFilter.GaussianBlur(1))
+        out = BytesIO()
+        img.save(out, "JPEG", quality=90)
+        _images[size] = out.getvalue()
+    return _images[size]
+
+
+def image_bytes(size: str, n: int) -> bytes:
+    # Trailing bytes after the JPEG end marker are ignored by decoders but make
+    # each image hash differently, so the image store can't dedupe them.
+    return base_image(size) + f"fixture-{size}-{n}".encode()
+
+
+def article_html(n: int) -> str:
+    parts = [f"<html><head><title>Post {n}</title></head><body>",
+             "<nav><a href='/'>Home</a> <a href='/about'>About</a></nav>",
+             f"<article><h2>Fixture post {n}</h2>"]
+    every = ARTICLE_PARAGRAPHS // len(ARTICLE_IMAGES)
+    for i in range(ARTICLE_PARAGRAPHS):
+        parts.append(
+            f"<p>Post {n}, paragraph {i}: the café opened at dawn — “quoted” text, "
+            f"<a href='/post/{(n + i) % 997}'>a link</a> and <em>emphasis</em>. "
+            + "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. " * 5
+            + "</p>"
+        )
+        if i % every == 0:
+            size = ARTICLE_IMAGES[i // every]
+            parts.append(f"<figure><img src='/img/{size}/{n * 10 + i // every}' alt='Figure {i}'>"
+                         f"<figcaption>Figure {i}</figcaption></figure>")
+    parts.append("</article><footer>Subscribe to the newsletter</footer></body></html>")
+    return "".join(parts)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        post = re.fullmatch(r"/post/(\d+)", self.path)
+        img = re.fullmatch(r"/img/(small|medium|large)/(\d+)", self.path)
+        if post:
+            self._send(article_html(int(post.group(1))).encode("utf-8"), "text/html; charset=utf-8")
+        elif img:
+            self._send(image_bytes(img.group(1), int(img.group(2))), "image/jpeg")
+        elif self.path == "/cover.jpg":
+            self._send(image_bytes("large", 0), "image/jpeg")
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def _send(self, body: bytes, content_type: str):
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int) -> None:
+    for size in IMAGE_WIDTHS:
+        base_image(size)
+    ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler).serve_forever()
+
+
+class FixtureServer:
+    """Runs the fixture server in a separate process, so its CPU time and memory
+    never show up in the measurements of the process under test."""
+
+    def __init__(self, port: int = 8799):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._process = None
+
+    def __enter__(self) -> "FixtureServer":
+        self._process = multiprocessing.get_context("spawn").Process(target=serve, args=(self.port,), daemon=True)
+        self._process.start()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                requests.get(f"{self.base_url}/cover.jpg", timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(0.1)
+        self._process.terminate()
+        raise RuntimeError(f"Fixture server did not start on port {self.port}")
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+    print(f"Serving fixtures on http://127.0.0.1:{args.port}")
+    serve(args.port)
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Root for every persistent cache; survives across requests (and restarts when
+# pointed at a volume).
+CACHE_DIR = os.getenv("BOOK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "contentbookify-cache"))
+
+
+class DiskCache:
+    """Persistent key/value cache with a TTL and size-bounded LRU eviction.
+
+    Each entry is a data file plus a small JSON metadata file. The data file's
+    mtime doubles as the last-access time, so eviction drops the least recently
+    used entries first once the cache grows past ``max_bytes``.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl: float | None = None):
+        self.name = name
+        self.root = os.path.join(CACHE_DIR, name)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._size = self._scan_size()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        base = os.path.join(self.root, digest[:2], digest)
+        return base + ".bin", base + ".json"
+
+    def _scan_size(self) -> int:
+        total = 0
+        for dirpath, _, files in os.walk(self.root):
+            for fname in files:
+                if not fname.endswith(".bin"):
+                    continue
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, fname))
+                except OSError:
+                    pass
+        return total
+
+    def path(self, key: str) -> str | None:
+        """Returns the data file for ``key`` (marking it used), or None."""
+        data_path, _ = self._paths(key)
+        try:
+            os.utime(data_path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data_path
+
+    def get(self, key: str) -> tuple[bytes, dict] | None:
+        """Returns ``(data, meta)`` for ``key`` even if stale, or None."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+            os.utime(data_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data, meta
+
+    def meta(self, key: str) -> dict | None:
+        """Metadata of ``key`` without reading (or touching) its data, or None."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(data_path) else None
+
+    def is_fresh(self, meta: dict) -> bool:
+        if self.ttl is None:
+            return True
+        return time.time() - meta.get("stored_at", 0) < self.ttl
+
+    def set(self, key: str, data: bytes, meta: dict | None = None) -> str:
+        """Stores ``data`` under ``key`` and returns the path of the data file."""
+        data_path, _ = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        part_path = f"{data_path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(part_path, "wb") as f:
+            f.write(data)
+        return self.set_file(key, part_path, meta)
+
+    def set_file(self, key: str, src_path: str, meta: dict | None = None) -> str:
+        """Moves the file at ``src_path`` in under ``key`` and returns the data file's path.
+
+        ``src_path`` should be on the cache's filesystem (e.g. from ``temp_path``)
+        so the move is an atomic rename.
+        """
+        data_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        size = os.path.getsize(src_path)
+        meta = dict(meta or {}, key=key, size=size, stored_at=time.time())
+
+        suffix = f".{os.getpid()}.{threading.get_ident()}.part"
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        replaced = _file_size(data_path)
+        shutil.move(src_path, data_path)
+        os.replace(meta_path + suffix, meta_path)
+
+        with self._lock:
+            # Overwriting a key only grows the cache by the difference
+            self._size = max(0, self._size + size - replaced)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+        return data_path
+
+    def temp_path(self, suffix: str = "") -> str:
+        """A fresh file path inside the cache directory, for ``set_file``."""
+        fd, path = tempfile.mkstemp(suffix=suffix + ".part", dir=self.root)
+        os.close(fd)
+        return path
+
+    def update_meta(self, key: str, **changes) -> None:
+        """Merges ``changes`` into the entry's metadata and resets its age."""
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        meta.update(changes, stored_at=time.time())
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def delete(self, key: str) -> None:
+        data_path, meta_path = self._paths(key)
+        size = _file_size(data_path)
+        for path in (data_path, meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if size:
+            with self._lock:
+                self._size = max(0, self._size - size)
+
+    def evict(self) -> None:
+        """Drops least recently used entries until the cache is under 90% of its cap."""
+        with self._lock:
+            entries = []
+            total = 0
+            for dirpath, _, files in os.walk(self.root):
+                for fname in files:
+                    if not fname.endswith(".bin"):
+                        continue
+                    data_path = os.path.join(dirpath, fname)
+                    try:
+                        st = os.stat(data_path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, data_path))
+                    total += st.st_size
+
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, data_path in sorted(entries):
+                if total <= target:
+                    break
+                for path in (data_path, data_path[:-4] + ".json"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                removed += 1
+
+            self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} entries from {self.name} cache")
+
+
+def _file_size(path: str) -> int:
+    """Size of the file at ``path``, or 0 if there is none."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,144 @@
+"""Builds many books from a manifest, without the web layer.
+
+The manifest is a JSON file (one book, a list of books, or ``{"books": [...]}``)
+or a JSONL file with one book per line. Books use the same shape as the
+``book`` field of ``POST /generate-book/``. All builds in a run share the
+article, image and fragment caches, and PDFs are written straight to
+``--out-dir``; books that haven't changed since an earlier run are copied
+from the book cache instead of being rebuilt.
+
+Usage (from src/backend):
+    python cli.py digests.jsonl --out-dir out/ [--concurrency 4]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def load_manifest(path: str) -> list[dict]:
+    """Book definitions from a JSON or JSONL manifest."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSONL: one book per non-empty line
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    if isinstance(data, dict):
+        data = data.get("books", [data])
+    # Accept request bodies ({"book": {...}}) as well as bare books
+    return [entry.get("book", entry) if isinstance(entry, dict) else entry for entry in data]
+
+
+def validate_book(book) -> str | None:
+    """Why ``book`` can't be built, or None."""
+    if not isinstance(book, dict):
+        return "not a JSON object"
+    if not isinstance(book.get("chapters"), list) or not book["chapters"]:
+        return "no chapters"
+    if book.get("format", "PDF") != "PDF":
+        return f"unsupported format {book.get('format')}"
+    return None
+
+
+def output_paths(books: list[dict], out_dir: str) -> list[str]:
+    """One PDF path per book, named like the API's downloads and never colliding."""
+    from services import book_file_name
+
+    paths, used = [], set()
+    for book in books:
+        stem, ext = os.path.splitext(book_file_name(book) if isinstance(book, dict) else "book.pdf")
+        name, n = stem + ext, 1
+        while name in used:
+            n += 1
+            name = f"{stem}-{n}{ext}"
+        used.add(name)
+        paths.append(os.path.join(out_dir, name))
+    return paths
+
+
+def cache_counts(caches: dict) -> dict:
+    return {name: (cache.hits, cache.misses) for name, cache in caches.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="JSON or JSONL file of book definitions")
+    parser.add_argument("--out-dir", default="books", help="directory for the PDFs (default: ./books)")
+    parser.add_argument("--concurrency", type=int, default=min(4, os.cpu_count() or 1),
+                        help="books built at once (default: min(4, CPUs))")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every pipeline step")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    from services import build_book_pdf_cached, article_cache, image_store, book_cache
+    from renderer import warm_up, shutdown_render_pool, fragment_cache
+
+    books = load_manifest(args.manifest)
+    os.makedirs(args.out_dir, exist_ok=True)
+    paths = output_paths(books, args.out_dir)
+    caches = {"books": book_cache, "articles": article_cache, "images": image_store.urls, "fragments": fragment_cache}
+
+    report = warm_up()
+    if not report.get("ready"):
+        print(f"Renderer unavailable: {report.get('error')}", file=sys.stderr)
+        sys.exit(1)
+
+    counts_before = cache_counts(caches)
+    started = time.perf_counter()
+    failed = 0
+    chapters = 0
+    written = 0
+    saved = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="cli-book") as executor:
+            futures = {}
+            for book, path in zip(books, paths):
+                problem = validate_book(book)
+                if problem:
+                    failed += 1
+                    print(f"SKIP  {path}: {problem}", file=sys.stderr)
+                    continue
+                futures[executor.submit(build_book_pdf_cached, book, path)] = (book, path)
+
+            for future in as_completed(futures):
+                book, path = futures[future]
+                result = future.result()
+                if result.get("success"):
+                    chapters += len(book["chapters"])
+                    written += os.path.getsize(path)
+                    saved += result.get("bytesSaved", 0)
+                    print(f"OK    {path}")
+                    for chapter in result.get("degradedChapters", []):
+                        print(f"      degraded chapter {chapter['index'] + 1} ({', '.join(chapter['steps'])}): "
+                              f"{chapter['title']}", file=sys.stderr)
+                else:
+                    failed += 1
+                    print(f"FAIL  {path}: {result.get('error')}", file=sys.stderr)
+    finally:
+        shutdown_render_pool()
+    elapsed = time.perf_counter() - started
+
+    built = len(books) - failed
+    print(f"\n{built}/{len(books)} books, {chapters} chapters, {written / (1024 * 1024):.1f} MB in {elapsed:.1f}s")
+    if saved:
+        print(f"PDF optimization saved {saved / (1024 * 1024):.1f} MB")
+    if elapsed > 0:
+        print(f"Throughput: {built / elapsed * 60:.1f} books/min, {chapters / elapsed * 60:.1f} chapters/min")
+    for name, (hits, misses) in cache_counts(caches).items():
+        hits -= counts_before[name][0]
+        misses -= counts_before[name][1]
+        lookups = hits + misses
+        rate = f"{hits / lookups:.0%}" if lookups else "n/a"
+        print(f"Cache {name:<10} {rate:>5} hit rate ({hits}/{lookups})")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
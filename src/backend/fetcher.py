@@ -0,0 +1,349 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Connections open at once across every book being built in this process
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "32"))
+# Connections open at once to any single host (Medium, Substack, a CDN, ...)
+FETCH_PER_HOST = int(os.getenv("FETCH_PER_HOST", "4"))
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+# Longest Retry-After we are willing to wait out
+FETCH_MAX_RETRY_AFTER = float(os.getenv("FETCH_MAX_RETRY_AFTER", "30"))
+
+# Largest body accepted for one article page / one image, and for all the
+# downloads of one book build together
+FETCH_MAX_PAGE_BYTES = int(os.getenv("FETCH_MAX_PAGE_BYTES", str(10 * 1024 * 1024)))
+FETCH_MAX_IMAGE_BYTES = int(os.getenv("FETCH_MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+BOOK_MAX_DOWNLOAD_BYTES = int(os.getenv("BOOK_MAX_DOWNLOAD_BYTES", str(500 * 1024 * 1024)))
+
+PAGE_CONTENT_TYPES = ("text/", "application/xhtml")
+# Object stores often serve images as octet-stream; Pillow checks those later
+IMAGE_CONTENT_TYPES = ("image/", "application/octet-stream", "binary/octet-stream")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHUNK_SIZE = 64 * 1024
+
+
+class ResponseRejected(Exception):
+    """A response refused for its size or content type (never retried)."""
+
+
+class DeadlineExceeded(Exception):
+    """The book build ran out of time before this request could finish."""
+
+
+class Deadline:
+    """Point in time by which every fetch of one book build must be done."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+# Deadline of the book build running in this context (see build_book_pdf)
+book_deadline: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar("book_deadline", default=None)
+
+
+def time_left() -> float | None:
+    """Seconds until this context's deadline (may be negative), or None without one."""
+    deadline = book_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def deadline_passed() -> bool:
+    left = time_left()
+    return left is not None and left <= 0
+
+
+def check_deadline() -> float | None:
+    """Raises DeadlineExceeded once the deadline has passed; else returns time_left()."""
+    left = time_left()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("book deadline reached")
+    return left
+
+
+class ByteBudget:
+    """Bytes a book build may still download, shared by all of its workers."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size: int) -> None:
+        with self._lock:
+            self.used += size
+            if self.used > self.limit:
+                raise ResponseRejected(f"book download budget of {self.limit} bytes exhausted")
+
+
+# Budget of the book build running in this context (see build_book_pdf)
+book_budget: contextvars.ContextVar[ByteBudget | None] = contextvars.ContextVar("book_budget", default=None)
+
+
+def check_response_headers(status_code: int, headers, max_bytes: int | None, content_types: tuple | None) -> None:
+    """Rejects a response from its headers alone, before any of the body is read."""
+    if status_code != 200:
+        return
+    content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_types and content_type and not content_type.startswith(content_types):
+        raise ResponseRejected(f"unexpected content type {content_type}")
+    length = headers.get("Content-Length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise ResponseRejected(f"body of {length} bytes exceeds the {max_bytes} byte limit")
+
+
+def count_body_bytes(received: int, size: int, max_bytes: int | None) -> int:
+    """Adds ``size`` freshly read bytes, enforcing the response and book limits."""
+    # A host trickling bytes never trips the read timeout; stop it here
+    check_deadline()
+    received += size
+    if max_bytes and received > max_bytes:
+        raise ResponseRejected(f"body exceeds the {max_bytes} byte limit")
+    budget = book_budget.get()
+    if budget is not None:
+        budget.consume(size)
+    return received
+
+
+class FetchScheduler:
+    """Central gate for the book builder's outbound HTTP requests.
+
+    Every request waits for a slot on its host (``per_host``) and then for one of
+    the process-wide slots (``max_connections``), so no host gets hammered.
+    Callers with many requests queue them per host first (``HostQueueExecutor``)
+    so a busy host never holds threads that other hosts could use. Connections are kept alive in a shared
+    ``requests`` pool. Throttling responses (429/5xx) and connection errors are
+    retried with jittered exponential backoff, and a Retry-After from a host
+    pauses every request to that host, not just the one that got it.
+
+    Bodies are streamed in chunks while the slot is held and are capped per
+    response (``max_bytes``) and per book (``book_budget``), so no response can
+    grow a worker's memory past the limits.
+
+    Under a ``book_deadline`` slot waits, timeouts and retry delays are cut to
+    the time left, and DeadlineExceeded is raised once it runs out.
+    """
+
+    def __init__(self, max_connections: int, per_host: int, max_retries: int):
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self._global_slots = threading.BoundedSemaphore(max_connections)
+        self._host_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._host_resume_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0 (compatible; ContentBookify/1.0)"
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _slots_for(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slots = self._host_slots.get(host)
+            if slots is None:
+                slots = self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return slots
+
+    def _wait_for_host(self, host: str) -> None:
+        with self._lock:
+            resume_at = self._host_resume_at.get(host, 0)
+        delay = resume_at - time.monotonic()
+        if delay > 0:
+            _sleep_within_deadline(delay)
+
+    def _acquire(self, slots: threading.BoundedSemaphore) -> None:
+        left = check_deadline()
+        if not slots.acquire(timeout=max(left, 0) if left is not None else None):
+            raise DeadlineExceeded("book deadline reached while waiting for a connection slot")
+
+    def _pause_host(self, host: str, delay: float) -> None:
+        with self._lock:
+            resume_at = time.monotonic() + delay
+            self._host_resume_at[host] = max(self._host_resume_at.get(host, 0), resume_at)
+
+    def get(
+        self,
+        url: str,
+        timeout: float,
+        headers: dict | None = None,
+        max_bytes: int | None = None,
+        content_types: tuple | None = None,
+        dest: str | None = None,
+    ) -> requests.Response:
+        """GETs ``url`` within the host/global limits, retrying transient failures.
+
+        The body is written to ``dest`` if given, otherwise kept on the response
+        as usual. A 200 whose Content-Type doesn't start with one of
+        ``content_types``, or whose body exceeds ``max_bytes``, raises
+        ResponseRejected. Returns the last response (even a non-2xx one) or
+        raises the last connection error once retries are exhausted.
+        """
+        host = urlparse(url).netloc
+        host_slots = self._slots_for(host)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_host(host)
+            resp, error = None, None
+            self._acquire(host_slots)
+            try:
+                self._acquire(self._global_slots)
+            except DeadlineExceeded:
+                host_slots.release()
+                raise
+            try:
+                left = check_deadline()
+                request_timeout = min(timeout, left) if left is not None else timeout
+                resp = self.session.get(url, timeout=request_timeout, headers=headers, stream=True)
+                if resp.status_code not in RETRY_STATUSES:
+                    read_body(resp, max_bytes, content_types, dest)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if resp is not None:
+                    resp.close()
+                resp, error = None, e
+            except (ResponseRejected, DeadlineExceeded):
+                if resp is not None:
+                    resp.close()
+                raise
+            finally:
+                self._global_slots.release()
+                host_slots.release()
+
+            if resp is not None and resp.status_code not in RETRY_STATUSES:
+                return resp
+            if attempt == self.max_retries:
+                if resp is not None:
+                    return resp
+                raise error
+
+            delay = backoff_delay(attempt)
+            retry_after = retry_after_seconds(resp) if resp is not None else None
+            if retry_after is not None:
+                delay = min(retry_after, FETCH_MAX_RETRY_AFTER)
+                self._pause_host(host, delay)
+            if resp is not None:
+                resp.close()
+            logger.info(f"Retrying {url} in {delay:.1f}s ({resp.status_code if resp is not None else error})")
+            _sleep_within_deadline(delay)
+
+
+class HostQueueExecutor:
+    """Thread pool that only hands a worker a task whose host has a free slot.
+
+    Up to ``per_host`` tasks per host run at once; the rest wait in that host's
+    own queue rather than the pool's, so a book with hundreds of images on one
+    CDN can't park every worker while images from other hosts wait behind it.
+    """
+
+    def __init__(self, max_workers: int, per_host: int, thread_name_prefix: str = ""):
+        self.per_host = per_host
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._running: dict[str, int] = {}
+        self._waiting: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, host: str, fn, *args) -> Future:
+        future = Future()
+        with self._lock:
+            running = self._running.get(host, 0)
+            if running >= self.per_host:
+                self._waiting.setdefault(host, deque()).append((future, fn, args))
+                return future
+            self._running[host] = running + 1
+        self._pool.submit(self._run, host, future, fn, args)
+        return future
+
+    def _run(self, host: str, future: Future, fn, args: tuple) -> None:
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            self._next(host)
+
+    def _next(self, host: str) -> None:
+        """Hands the host's slot to its next queued task, or frees it."""
+        with self._lock:
+            waiting = self._waiting.get(host)
+            if not waiting:
+                self._running[host] -= 1
+                if not self._running[host]:
+                    del self._running[host]
+                return
+            task = waiting.popleft()
+            if not waiting:
+                del self._waiting[host]
+        self._pool.submit(self._run, host, *task)
+
+
+def read_body(resp: requests.Response, max_bytes: int | None, content_types: tuple | None, dest: str | None) -> None:
+    """Reads a streamed body in chunks, into ``dest`` or onto the response."""
+    check_response_headers(resp.status_code, resp.headers, max_bytes, content_types)
+    received = 0
+    if dest is not None:
+        try:
+            with open(dest, "wb") as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    received = count_body_bytes(received, len(chunk), max_bytes)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(dest)
+            raise
+        resp._content = b""
+        return
+
+    chunks = []
+    for chunk in resp.iter_content(CHUNK_SIZE):
+        received = count_body_bytes(received, len(chunk), max_bytes)
+        chunks.append(chunk)
+    # Same as requests does when it reads the body itself; .text/.content work as usual
+    resp._content = b"".join(chunks)
+
+
+def _sleep_within_deadline(delay: float) -> None:
+    """Sleeps ``delay`` seconds, unless the deadline comes first (DeadlineExceeded)."""
+    left = time_left()
+    if left is not None and delay >= left:
+        raise DeadlineExceeded("book deadline reached before the next attempt")
+    time.sleep(delay)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 10.0) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(resp: requests.Response) -> float | None:
+    """Parses a Retry-After header (seconds or HTTP date), if present."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+fetch_scheduler = FetchScheduler(FETCH_MAX_CONNECTIONS, FETCH_PER_HOST, FETCH_MAX_RETRIES)
@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from urllib.parse import urljoin, urlparse
+
+from PIL import Image, ImageOps
+
+from cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Print settings for localized images: anything wider than its printed width
+# at IMAGE_TARGET_DPI is downsampled, then re-encoded without metadata.
+IMAGE_TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", "200"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+# Larger images are dropped rather than decoded (a decoded pixel costs 3-4 bytes)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+# Images decoded at once; with IMAGE_MAX_PIXELS this bounds decode memory
+IMAGE_DECODE_CONCURRENCY = int(os.getenv("IMAGE_DECODE_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+
+# Printed widths on A4: text block inside the 2cm margins, and the full-bleed cover
+CONTENT_WIDTH_MM = 170
+COVER_WIDTH_MM = 210
+
+_FORMAT_EXT = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+_decode_slots = threading.BoundedSemaphore(IMAGE_DECODE_CONCURRENCY)
+
+# Lazy-loading libraries keep the real image here and a placeholder in src
+LAZY_SRC_ATTRS = ("data-src", "data-lazy-src", "data-original", "data-hi-res-src", "data-url")
+LAZY_SRCSET_ATTRS = ("data-srcset", "data-lazy-srcset")
+# Formats WeasyPrint/Pillow can be relied on to draw
+PRINTABLE_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+# Images no bigger than this (both sides, from their attributes) are icons
+ICON_MAX_PX = 32
+# A file name like "avatar-..." or "share-..." only marks an image decorative
+# when it is also declared no bigger than this
+DECORATIVE_MAX_PX = 96
+
+# Hosts that only serve analytics beacons; any image from them (or their
+# subdomains) is a tracking pixel
+TRACKING_HOSTS = (
+    "google-analytics.com", "doubleclick.net", "stats.wp.com", "pixel.wp.com",
+    "feedburner.com", "scorecardresearch.com", "quantserve.com", "bat.bing.com",
+    "analytics.twitter.com", "px.ads.linkedin.com", "ct.pinterest.com",
+)
+# File names that are nothing but one of these words...
+_TRACKING_NAME_RE = re.compile(r"pixel|beacon|track|tracking|tracker|spacer|blank|transparent|clear|1x1", re.I)
+# ...or contain one of these as a token ("tracking-pixel", "spacer_1x1");
+# like the decorative words, they only count on a tiny declared image
+_TRACKING_TOKEN_RE = re.compile(
+    r"(^|[\W_])(beacon|spacer|tracking|tracker|1x1|(tracking|transparent|blank|clear|spy|open)[\W_]?(pixel|gif))([\W_]|$)",
+    re.I,
+)
+_DECORATIVE_RE = re.compile(r"(^|[\W_])(emoji|icons?|avatar|share|sharing|spinner|placeholder|badge)([\W_]|$)", re.I)
+
+
+class ImageTooLarge(ValueError):
+    """An image whose pixel count exceeds IMAGE_MAX_PIXELS."""
+
+
+class ImageStore:
+    """Content-addressed image store shared by every book build.
+
+    Blobs are keyed by the SHA-256 of their bytes, so the same image served
+    from different URLs is stored once. A small URL index maps each source URL
+    to its blob; both sides are LRU-evicted by ``DiskCache``.
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.blobs = DiskCache(os.path.join(name, "blobs"), max_bytes=max_bytes)
+        self.urls = DiskCache(os.path.join(name, "urls"), max_bytes=max(max_bytes // 100, 1024 * 1024))
+
+    def lookup(self, url: str, variant: str = "") -> tuple[str, str] | None:
+        """Returns ``(blob_path, file_name)`` for an already stored URL, or None."""
+        url = f"{url}#{variant}" if variant else url
+        cached = self.urls.get(url)
+        if not cached:
+            return None
+        entry = json.loads(cached[0])
+        blob_path = self.blobs.path(entry["digest"])
+        if not blob_path:
+            # Blob was evicted; the index entry is useless now
+            self.urls.delete(url)
+            return None
+        return blob_path, entry["digest"] + entry["ext"]
+
+    def put(self, url: str, content: bytes, ext: str, variant: str = "") -> tuple[str, str]:
+        """Stores ``content`` fetched from ``url`` and returns ``(blob_path, file_name)``."""
+        url = f"{url}#{variant}" if variant else url
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self.blobs.path(digest)
+        if not blob_path:
+            blob_path = self.blobs.set(digest, content, {"url": url})
+        self.urls.set(url, json.dumps({"digest": digest, "ext": ext}).encode("utf-8"))
+        return blob_path, digest + ext
+
+    def blob_path(self, file_name: str) -> str | None:
+        """Path of a stored blob by the file name ``put``/``lookup`` returned, or None."""
+        return self.blobs.path(os.path.splitext(file_name)[0])
+
+    @staticmethod
+    def link(blob_path: str, images_dir: str, file_name: str) -> bool:
+        """Places a stored blob at ``images_dir/file_name`` without re-reading it when possible."""
+        dest = os.path.join(images_dir, file_name)
+        if os.path.exists(dest):
+            return True
+        try:
+            os.link(blob_path, dest)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # Different filesystem (or no hard links): fall back to a copy
+            try:
+                shutil.copyfile(blob_path, dest)
+            except OSError as e:
+                logger.warning(f"Could not copy stored image {blob_path}: {e}")
+                return False
+        return True
+
+
+def image_ext(url: str) -> str:
+    """File extension for an image URL, ignoring any query string."""
+    ext = os.path.splitext(url.split('?')[0])[-1]
+    return ext if ext and len(ext) <= 5 else ".jpg"
+
+
+def print_width_px(width_mm: float, dpi: int = IMAGE_TARGET_DPI) -> int:
+    """Pixel width needed to print ``width_mm`` at ``dpi``."""
+    return round(width_mm / 25.4 * dpi)
+
+
+def print_variant(max_width_px: int) -> str:
+    """Store variant tag for images prepared with the current print settings."""
+    return f"{max_width_px}w-{IMAGE_FORMAT.lower()}-q{IMAGE_QUALITY}"
+
+
+def prepare_for_print(content: bytes | str, ext: str, max_width_px: int) -> tuple[bytes, str]:
+    """Downsamples an image to ``max_width_px`` and re-encodes it without metadata.
+
+    ``content`` is the image bytes or the path of a downloaded file, which is
+    then decoded straight from disk. Images Pillow cannot open (e.g. SVG) are
+    returned untouched, as are images that would only grow by re-encoding.
+    Raises ImageTooLarge for images over IMAGE_MAX_PIXELS.
+    """
+    with _decode_slots:
+        return _prepare_for_print(content, ext, max_width_px)
+
+
+def _prepare_for_print(content: bytes | str, ext: str, max_width_px: int) -> tuple[bytes, str]:
+    try:
+        img = Image.open(content if isinstance(content, str) else BytesIO(content))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        return _original(content), ext
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f"{img.width}x{img.height} image exceeds {IMAGE_MAX_PIXELS} pixels")
+    try:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale; ask for the smallest
+        # that still covers the print width once EXIF rotation is applied
+        full_size = img.size
+        width, height = full_size
+        if img.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+            img.draft(img.mode, (-(-width * max_width_px // height), max_width_px))
+        else:
+            img.draft(img.mode, (max_width_px, -(-height * max_width_px // width)))
+        img.load()
+        drafted = img.size != full_size
+    except Exception:
+        return _original(content), ext
+
+    try:
+        # Bake in EXIF rotation before the metadata is dropped
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        # Transparent and palette (diagram/line-art) images stay lossless
+        lossless = has_alpha or img.mode in ("P", "1")
+        fmt = "PNG" if lossless and IMAGE_FORMAT == "JPEG" else IMAGE_FORMAT
+        if fmt == "JPEG" or img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if has_alpha and fmt != "JPEG" else "RGB")
+
+        resized = drafted or img.width > max_width_px
+        if img.width > max_width_px:
+            height = max(1, round(img.height * max_width_px / img.width))
+            img = img.resize((max_width_px, height), Image.LANCZOS)
+
+        out = BytesIO()
+        if fmt == "PNG":
+            img.save(out, "PNG", optimize=True)
+        else:
+            img.save(out, fmt, quality=IMAGE_QUALITY, optimize=True)
+        data = out.getvalue()
+    except Exception as e:
+        logger.warning(f"Could not prepare image for print: {e}")
+        return _original(content), ext
+
+    original_size = os.path.getsize(content) if isinstance(content, str) else len(content)
+    if not resized and len(data) >= original_size:
+        return _original(content), ext
+    return data, _FORMAT_EXT.get(fmt, ext)
+
+
+def _original(content: bytes | str) -> bytes:
+    if isinstance(content, str):
+        with open(content, "rb") as f:
+            return f.read()
+    return content
+
+
+def parse_srcset(srcset: str) -> list[tuple[str, float | None, float | None]]:
+    """``(url, width, density)`` for each candidate of a ``srcset`` attribute."""
+    candidates = []
+    # Commas inside URLs are legal, so split on commas followed by whitespace
+    for part in re.split(r",\s+", srcset.strip()):
+        tokens = part.strip().rstrip(",").split()
+        if not tokens:
+            continue
+        url, width, density = tokens[0], None, None
+        for descriptor in tokens[1:]:
+            try:
+                if descriptor.endswith("w"):
+                    width = float(descriptor[:-1])
+                elif descriptor.endswith("x"):
+                    density = float(descriptor[:-1])
+            except ValueError:
+                pass
+        candidates.append((url, width, density))
+    return candidates
+
+
+def _attr_px(img, name: str) -> int | None:
+    value = (img.get(name) or "").strip().removesuffix("px")
+    return int(value) if value.isdigit() else None
+
+
+def enclosing_picture(img):
+    """The ``<picture>`` around ``img``, or None.
+
+    libxml2 doesn't know ``<source>`` is a void element, so the ``<img>`` may
+    end up nested inside one or more ``<source>`` elements.
+    """
+    parent = img.getparent()
+    while parent is not None and parent.tag == "source":
+        parent = parent.getparent()
+    return parent if parent is not None and parent.tag == "picture" else None
+
+
+def select_image_source(img, base_url: str, min_width_px: int) -> str | None:
+    """Absolute URL of the best candidate to print ``img`` at ``min_width_px``.
+
+    Looks at lazy-load attributes, ``srcset`` and the ``<source>`` elements of
+    an enclosing ``<picture>``, and picks the smallest candidate that is still
+    at least ``min_width_px`` wide (or the largest one if none is). Returns
+    None when the image has no usable source.
+    """
+    src = next((img.get(attr) for attr in LAZY_SRC_ATTRS if img.get(attr)), None) or img.get("src")
+    if src and src.startswith("data:"):
+        # Inline placeholders (or inline images, which need no download)
+        src = None if any(img.get(attr) for attr in LAZY_SRCSET_ATTRS) or img.get("srcset") else src
+
+    srcsets = [img.get(attr) for attr in LAZY_SRCSET_ATTRS + ("srcset",) if img.get(attr)]
+    picture = enclosing_picture(img)
+    if picture is not None:
+        for source in picture.iter("source"):
+            media_type = (source.get("type") or "").lower()
+            if media_type and media_type not in PRINTABLE_TYPES:
+                continue
+            srcsets.extend(source.get(attr) for attr in LAZY_SRCSET_ATTRS + ("srcset",) if source.get(attr))
+
+    layout_width = _attr_px(img, "width")
+    sized = []
+    for srcset in srcsets:
+        for url, width, density in parse_srcset(srcset):
+            if width is None and density is not None and layout_width:
+                width = layout_width * density
+            sized.append((width, density or 1.0, url))
+
+    with_width = [c for c in sized if c[0]]
+    if with_width:
+        big_enough = [c for c in with_width if c[0] >= min_width_px]
+        chosen = min(big_enough)[2] if big_enough else max(with_width)[2]
+    elif sized:
+        # Density descriptors only: the highest density is closest to print
+        chosen = max(sized, key=lambda c: c[1])[2]
+    else:
+        chosen = src
+
+    if not chosen:
+        return None
+    if chosen.startswith("data:"):
+        return chosen
+    return urljoin(base_url, chosen)
+
+
+def is_decorative_image(img, url: str) -> bool:
+    """True for tracking pixels, icons, emoji, avatars and share buttons.
+
+    Decided from the URL and the element's attributes alone, before any
+    network request. Words like "avatar", "share" or "tracker" in the file name
+    alone are not enough ("share-price-chart.png", "habit-tracker.png"); they
+    need a small declared size, or must appear in the class, id or role. Only
+    known tracker hosts are dropped on the URL alone.
+    """
+    width, height = _attr_px(img, "width"), _attr_px(img, "height")
+    if (width is not None and width <= 2) or (height is not None and height <= 2):
+        return True
+    if width is not None and height is not None and width <= ICON_MAX_PX and height <= ICON_MAX_PX:
+        return True
+
+    if url.startswith("data:"):
+        return False
+    parsed = urlparse(url)
+    file_stem = os.path.splitext(os.path.basename(parsed.path))[0]
+    host = (parsed.hostname or "").lower()
+    if any(host == tracker or host.endswith("." + tracker) for tracker in TRACKING_HOSTS):
+        return True
+    if (host == "facebook.com" or host.endswith(".facebook.com")) and parsed.path.startswith("/tr"):
+        return True
+    if img.get("role") == "presentation":
+        return True
+    markup_hints = " ".join(filter(None, (img.get("class"), img.get("id"), img.get("role"))))
+    if _DECORATIVE_RE.search(markup_hints):
+        return True
+    declared = [size for size in (width, height) if size is not None]
+    if not declared or max(declared) > DECORATIVE_MAX_PX:
+        return False
+    return bool(
+        _TRACKING_NAME_RE.fullmatch(file_stem)
+        or _TRACKING_TOKEN_RE.search(file_stem)
+        or _DECORATIVE_RE.search(file_stem)
+    )
@@ -0,0 +1,129 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CACHE_DIR
+from services import BuildProgress, build_book_pdf_cached, book_file_name
+
+logger = logging.getLogger(__name__)
+
+# Book builds running at once; further submissions wait in the queue
+BOOK_JOB_WORKERS = int(os.getenv("BOOK_JOB_WORKERS", "2"))
+# How long a finished job (and its PDF) stays available for download
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOBS_DIR = os.path.join(CACHE_DIR, "jobs")
+# Seconds between sweeps of expired jobs and leftover PDFs in JOBS_DIR
+JOB_PRUNE_INTERVAL = float(os.getenv("JOB_PRUNE_INTERVAL", "600"))
+
+
+class BookJob:
+    """One queued/running/finished book build."""
+
+    def __init__(self, book_data: dict):
+        self.id = uuid.uuid4().hex
+        self.book_data = book_data
+        self.status = "queued"
+        self.progress = BuildProgress()
+        self.error = None
+        self.degraded_chapters = []
+        self.bytes_saved = None
+        self.file_name = book_file_name(book_data)
+        self.result_path = os.path.join(JOBS_DIR, f"{self.id}.pdf")
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "progress": self.progress.snapshot(),
+            "error": self.error,
+            "degradedChapters": self.degraded_chapters,
+            "bytesSaved": self.bytes_saved,
+            "fileName": self.file_name,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=BOOK_JOB_WORKERS, thread_name_prefix="book-job")
+_jobs: dict[str, BookJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def submit_book_job(book_data: dict) -> BookJob:
+    """Queues a book build on the background workers and returns its job.
+
+    Does no file I/O, so it's safe to call from the event loop; expired jobs are
+    pruned by the app's periodic sweep.
+    """
+    job = BookJob(book_data)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _executor.submit(_run_job, job)
+    return job
+
+
+def get_job(job_id: str) -> BookJob | None:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _run_job(job: BookJob) -> None:
+    job.status = "running"
+    status = "failed"
+    try:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        result = build_book_pdf_cached(job.book_data, job.result_path, job.progress)
+        if result.get("success"):
+            job.degraded_chapters = result.get("degradedChapters", [])
+            job.bytes_saved = result.get("bytesSaved", 0)
+            status = "succeeded"
+        else:
+            job.error = result.get("error")
+    except Exception as e:
+        logger.error(f"Book job {job.id} crashed: {e}")
+        job.error = str(e)
+    job.finished_at = time.time()
+    job.progress.start("done")
+    # Set last: pollers treat a final status as "everything else is filled in"
+    job.status = status
+
+
+def prune_finished_jobs() -> None:
+    """Forgets jobs finished more than JOB_RESULT_TTL ago and deletes their PDFs.
+
+    Also removes PDFs in JOBS_DIR older than the TTL that no known job owns,
+    e.g. results left behind by an earlier process.
+    """
+    cutoff = time.time() - JOB_RESULT_TTL
+    with _jobs_lock:
+        expired = [job for job in _jobs.values() if job.finished and job.finished_at < cutoff]
+        for job in expired:
+            del _jobs[job.id]
+        known = {os.path.basename(job.result_path) for job in _jobs.values()}
+    for job in expired:
+        try:
+            os.remove(job.result_path)
+        except OSError:
+            pass
+
+    try:
+        entries = list(os.scandir(JOBS_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.name.endswith(".pdf") or entry.name in known:
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
@@ -1,9 +1,25 @@
-from fastapi import FastAPI, HTTPException
-from services import generate_book_cover
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import os
+import json
+import logging
+import asyncio
+import mimetypes
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from services import generate_book_cover_async, close_async_clients
+from services import cover_store, cover_asset_name, COVER_ASSET_PATH, COVER_ASSET_RE
+from renderer import warm_up, shutdown_render_pool, STARTUP_REPORT
+from metrics import ServerTimingMiddleware, render_metrics
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 load_dotenv()
-from services import fetch_article_content, generate_chapter_summary
+from services import fetch_article_content_async, generate_chapter_summary_async, generate_chapter_summaries_async
 from pydantic import BaseModel
 
 class ArticleRequest(BaseModel):
@@ -13,7 +29,66 @@ class SummaryRequest(BaseModel):
     title: str
     content: str
 
-app = FastAPI()
+class ChapterSummaryRequest(BaseModel):
+    id: str | None = None
+    title: str
+    content: str
+
+class BatchSummaryRequest(BaseModel):
+    chapters: list[ChapterSummaryRequest]
+
+logger = logging.getLogger(__name__)
+
+# Public origin of this backend, used for absolute asset URLs (e.g. behind a proxy)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resolve WeasyPrint's libraries and start the render workers (each parses
+    # the book CSS and renders a probe page) now, so the first export doesn't
+    # pay for it.
+    STARTUP_REPORT["imports"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+    await run_in_threadpool(warm_up)
+    STARTUP_REPORT["total"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+    logger.info(f"Startup report: {STARTUP_REPORT}")
+    # Job results outlive the in-memory job table (restarts, idle periods)
+    pruner = asyncio.create_task(prune_jobs_periodically())
+    yield
+    pruner.cancel()
+    await close_async_clients()
+    shutdown_render_pool()
+
+async def prune_jobs_periodically():
+    while True:
+        try:
+            await run_in_threadpool(prune_finished_jobs)
+        except Exception as e:
+            logger.warning(f"Pruning finished jobs failed: {e}")
+        await asyncio.sleep(JOB_PRUNE_INTERVAL)
+
+app = FastAPI(lifespan=lifespan)
+
+async def run_until_disconnect(http_request: Request, coro):
+    """Awaits ``coro`` but cancels it as soon as the client goes away.
+
+    Upstream calls (OpenAI, article downloads) can take tens of seconds; there
+    is no point finishing, or paying for, one nobody is waiting on.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=1.0)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected.")
+    finally:
+        if not task.done():
+            task.cancel()
+
+# Request latency histogram and per-stage Server-Timing headers
+app.add_middleware(ServerTimingMiddleware)
 
 # CORS configuration
 app.add_middleware(
@@ -26,44 +101,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "Server-Timing", "ETag", "X-PDF-Bytes-Saved", "X-Degraded-Chapters"],
 )
 
 @app.get("/")
 def home():
     return {"message": "Book Cover Generator Backend is running!"}
 
+@app.get("/startup")
+def startup_report():
+    """Seconds spent in each cold-start phase of this process."""
+    return STARTUP_REPORT
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage, upstream and request latency histograms, Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 class CoverRequest(BaseModel):
     prompt: str
 
 @app.post("/generate-cover/")
-async def create_book_cover(request: CoverRequest):
+async def create_book_cover(request: CoverRequest, http_request: Request):
     """API endpoint to generate book cover from prompt."""
     try:
         # Generate book cover
-        cover_url = generate_book_cover(request.prompt)
+        cover_url = await run_until_disconnect(http_request, generate_book_cover_async(request.prompt))
+        asset_id = cover_asset_name(cover_url)
+        if asset_id:
+            # Stored asset: hand out an absolute URL the browser can display
+            base_url = PUBLIC_BASE_URL or str(http_request.base_url)
+            cover_url = base_url.rstrip("/") + cover_url
 
         return {
             "message": "Book cover generated successfully",
             "cover_url": cover_url,
+            "asset_id": asset_id,
         }
+    except HTTPException:
+        # e.g. the 499 from run_until_disconnect
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/assets/covers/{asset_id}")
+def get_cover_asset(asset_id: str):
+    """Serves a generated cover from the local cover store."""
+    path = cover_store.blob_path(asset_id) if COVER_ASSET_RE.search(COVER_ASSET_PATH + asset_id) else None
+    if not path:
+        raise HTTPException(status_code=404, detail="Cover not found.")
+    media_type = mimetypes.guess_type(asset_id)[0] or "application/octet-stream"
+    # Asset IDs are content hashes, so the bytes behind one never change
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 @app.post("/fetch-article/")
-async def api_fetch_article(request: ArticleRequest):
-    result = fetch_article_content(request.url)
+async def api_fetch_article(request: ArticleRequest, http_request: Request):
+    result = await run_until_disconnect(http_request, fetch_article_content_async(request.url))
     if not result.get("success"):
         raise HTTPException(status_code=500, detail=result.get("error"))
     return result
 
 @app.post("/generate-summary/")
-async def api_generate_summary(request: SummaryRequest):
-    summary = generate_chapter_summary(request.title, request.content)
+async def api_generate_summary(request: SummaryRequest, http_request: Request):
+    summary = await run_until_disconnect(
+        http_request, generate_chapter_summary_async(request.title, request.content)
+    )
     if summary == "Summary generation failed." or summary == "Failed to generate summary.":
         return {"summary": summary}
     return {"summary": summary}
 
+@app.post("/generate-summaries/")
+async def api_generate_summaries(request: BatchSummaryRequest, http_request: Request):
+    """Summarizes all chapters of a book in one round trip."""
+    summaries = await run_until_disconnect(
+        http_request,
+        generate_chapter_summaries_async([chapter.model_dump() for chapter in request.chapters]),
+    )
+    return {"summaries": summaries}
+
 class Media(BaseModel):
     type: str
     url: str | None = None
@@ -77,6 +192,7 @@ class Chapter(BaseModel):
     url: str
     content: str | None = None
     media: list[Media] | None = None
+    articleId: str | None = None
 
 class BookCover(BaseModel):
     url: str
@@ -103,25 +219,167 @@ class Book(BaseModel):
 class GenerateBookRequest(BaseModel):
     book: Book
 
-from services import generate_book_pdf
+from services import generate_book_pdf, build_book_pdf, build_book_pdf_cached, book_cache_key, etag_matches
+from services import PREVIEW_PAGES, BOOK_DEADLINE_SECONDS
+from jobs import submit_book_job, get_job, prune_finished_jobs, JOB_PRUNE_INTERVAL
+
+def result_headers(result: dict) -> dict:
+    """ETag of a built book, bytes saved by PDF optimization, and the indices
+    of chapters degraded to meet its deadline."""
+    headers = {}
+    if result.get("etag"):
+        headers["ETag"] = f'"{result["etag"]}"'
+    if "bytesSaved" in result:
+        headers["X-PDF-Bytes-Saved"] = str(result["bytesSaved"])
+    if result.get("degradedChapters"):
+        headers["X-Degraded-Chapters"] = ",".join(str(chapter["index"]) for chapter in result["degradedChapters"])
+    return headers
+
+def not_modified(http_request: Request, book_data: dict) -> Response | None:
+    """A 304 for a client that already holds this exact book, else None."""
+    key = book_cache_key(book_data)
+    if etag_matches(http_request.headers.get("if-none-match"), key):
+        return Response(status_code=304, headers={"ETag": f'"{key}"'})
+    return None
 
 @app.post("/generate-book/")
-async def api_generate_book(request: GenerateBookRequest):
+async def api_generate_book(request: GenerateBookRequest, http_request: Request, response: Response):
     """API endpoint to generate book PDF."""
     try:
         if request.book.format != 'PDF':
              raise HTTPException(status_code=400, detail="Only PDF format is supported currently via this endpoint.")
              
         book_data = request.book.model_dump()
-        result = generate_book_pdf(book_data)
+        cached = await run_in_threadpool(not_modified, http_request, book_data)
+        if cached:
+            return cached
+
+        # The build blocks for a long time; keep it off the event loop
+        result = await run_in_threadpool(generate_book_pdf, book_data, BOOK_DEADLINE_SECONDS)
         
         if not result.get("success"):
              raise HTTPException(status_code=500, detail=result.get("error"))
-             
+
+        response.headers.update(result_headers(result))
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-book/pdf")
+def api_generate_book_file(request: GenerateBookRequest, http_request: Request):
+    """API endpoint to generate book PDF, streamed back as application/pdf.
+
+    Unlike /generate-book/ the PDF is never base64-encoded or held in memory:
+    it is rendered to a temp file and sent in chunks, then deleted. Repeat
+    exports of an unchanged book come from the book cache, or as a 304 when
+    the client sends the book's ETag in If-None-Match.
+    """
+    if request.book.format != 'PDF':
+        raise HTTPException(status_code=400, detail="Only PDF format is supported currently via this endpoint.")
+
+    book_data = request.book.model_dump()
+    cached = not_modified(http_request, book_data)
+    if cached:
+        return cached
+
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    result = build_book_pdf_cached(book_data, pdf_path, deadline_seconds=BOOK_DEADLINE_SECONDS)
+    if not result.get("success"):
+        os.remove(pdf_path)
+        raise HTTPException(status_code=500, detail=result.get("error"))
+
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        filename=result["fileName"],
+        headers=result_headers(result),
+        background=BackgroundTask(os.remove, pdf_path),
+    )
+
+@app.post("/generate-book/preview")
+def api_generate_book_preview(request: GenerateBookRequest, pages: int = Query(PREVIEW_PAGES, ge=1, le=20)):
+    """Quick layout/cover check: the cover plus the first ``pages`` pages of the
+    first chapter, as application/pdf.
+
+    Images that aren't cached yet are drawn as placeholders and downloads are
+    capped at PREVIEW_MAX_DOWNLOAD_BYTES, so a preview never pays for a full export.
+    """
+    if request.book.format != 'PDF':
+        raise HTTPException(status_code=400, detail="Only PDF format is supported currently via this endpoint.")
+
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    result = build_book_pdf(request.book.model_dump(), pdf_path, preview_pages=pages)
+    if not result.get("success"):
+        os.remove(pdf_path)
+        raise HTTPException(status_code=500, detail=result.get("error"))
+
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        filename=result["fileName"],
+        headers={"Cache-Control": "no-store", **result_headers(result)},
+        background=BackgroundTask(os.remove, pdf_path),
+    )
+
+@app.post("/jobs/generate-book/", status_code=202)
+async def api_submit_book_job(request: GenerateBookRequest):
+    """Queues a book build and returns its job ID right away."""
+    if request.book.format != 'PDF':
+        raise HTTPException(status_code=400, detail="Only PDF format is supported currently via this endpoint.")
+
+    job = submit_book_job(request.book.model_dump())
+    return {
+        "jobId": job.id,
+        "status": job.status,
+        "statusUrl": f"/jobs/{job.id}",
+        "eventsUrl": f"/jobs/{job.id}/events",
+        "resultUrl": f"/jobs/{job.id}/result",
+    }
+
+def _get_job_or_404(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def api_get_book_job(job_id: str):
+    return _get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def api_book_job_events(job_id: str):
+    """Server-sent events stream of job progress; ends once the job finishes."""
+    job = _get_job_or_404(job_id)
+
+    async def event_stream():
+        last = None
+        while True:
+            state = job.to_dict()
+            if state != last:
+                yield f"event: progress\ndata: {json.dumps(state)}\n\n"
+                last = state
+            if job.finished:
+                yield f"event: {job.status}\ndata: {json.dumps(state)}\n\n"
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def api_book_job_result(job_id: str):
+    job = _get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}.")
+    return FileResponse(job.result_path, media_type="application/pdf", filename=job.file_name)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
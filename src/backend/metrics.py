@@ -0,0 +1,183 @@
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Upper bounds (seconds) shared by every histogram: from cache hits to full books
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    """Minimal thread-safe Prometheus histogram with labels."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_SECONDS = Histogram(
+    "contentbookify_stage_seconds",
+    "Time spent in each pipeline stage.",
+    ("stage",),
+)
+UPSTREAM_SECONDS = Histogram(
+    "contentbookify_upstream_seconds",
+    "Latency of calls to upstream services (article hosts, image hosts, OpenAI).",
+    ("call", "outcome"),
+)
+REQUEST_SECONDS = Histogram(
+    "contentbookify_http_request_seconds",
+    "Latency of HTTP requests served by the API.",
+    ("method", "route", "status"),
+)
+HISTOGRAMS = (STAGE_SECONDS, UPSTREAM_SECONDS, REQUEST_SECONDS)
+
+# Per-request totals for the Server-Timing header: name -> [seconds, calls]
+_request_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_timings", default=None)
+
+
+def _record_request_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        # Concurrent workers of one request share this dict; the GIL keeps the
+        # read-modify-write of two list slots good enough for a diagnostic header
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def stage(name: str):
+    """Times a pipeline stage into the stage histogram and the request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Records a stage timed elsewhere (e.g. in a render worker process)."""
+    STAGE_SECONDS.observe(seconds, name)
+    _record_request_timing(name, seconds)
+
+
+@contextmanager
+def upstream(call: str):
+    """Times one call to an upstream service, labelled ``ok`` or ``error``."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe(seconds, call, outcome)
+        _record_request_timing(f"upstream-{call}", seconds)
+
+
+def in_context(fn):
+    """Wraps ``fn`` to run in a copy of the caller's context.
+
+    Plain ``ThreadPoolExecutor`` workers don't inherit context variables; this
+    keeps their timings attributed to the request that submitted them (and
+    lets them see the book's download budget).
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def render_metrics() -> str:
+    """All histograms in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return "\n".join(lines) + "\n"
+
+
+def server_timing_header(timings: dict) -> str:
+    return ", ".join(
+        f'{name};dur={seconds * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"'
+        for name, (seconds, calls) in timings.items()
+    )
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: request latency histogram plus a ``Server-Timing`` header.
+
+    Stages timed while handling a request (including in worker threads started
+    through ``in_context``) are summed into the response's Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = time.perf_counter() - started
+                entries = server_timing_header(timings)
+                value = f"total;dur={total * 1000:.1f}" + (f", {entries}" if entries else "")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
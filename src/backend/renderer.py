@@ -0,0 +1,444 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import DiskCache
+from metrics import stage, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# "fragments": render the cover and each chapter as separately cached PDFs and
+# stitch them together; "single": one WeasyPrint pass over the whole book.
+BOOK_RENDER_MODE = os.getenv("BOOK_RENDER_MODE", "fragments")
+
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+fragment_cache = DiskCache("fragments", max_bytes=FRAGMENT_CACHE_MAX_BYTES)
+
+# WeasyPrint runs in this many pre-warmed worker processes, so renders use
+# every core and never hold the API process's GIL; 0 renders in-process.
+# Each worker is replaced after RENDER_MAX_TASKS renders to cap its memory.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_MAX_TASKS = int(os.getenv("RENDER_MAX_TASKS", "50"))
+
+# Post-render pass: merge identical objects (images repeated across chapters,
+# shared resources) and recompress page content; "0" ships PDFs as rendered
+PDF_OPTIMIZE = os.getenv("PDF_OPTIMIZE", "1") != "0"
+
+BOOK_CSS = """
+@page {
+  size: A4;
+  margin: 2cm;
+}
+
+body { font-family: "Georgia"; line-height: 1.55; }
+h1 { page-break-before: always; font-size: 24pt; }
+h2 { font-size: 16pt; margin-top: 1.5em; }
+p  { margin: 0.8em 0; text-align: justify; }
+figure { page-break-inside: avoid; }
+.image-placeholder {
+  height: 5cm;
+  margin: 1em 0;
+  padding: 0.5em;
+  border: 1px dashed #bbb;
+  background: #f4f4f4;
+  color: #888;
+  font-size: 9pt;
+  text-align: center;
+}
+"""
+
+# Cover as first page (named page "cover"), then content on the "content" page
+COVER_CSS = """
+@page cover {
+    size: A4;
+    margin: 0;
+}
+@page content {
+    size: A4;
+    margin: 2cm;
+}
+.cover-wrapper {
+    page: cover;
+    position: relative;
+    width: 210mm;
+    height: 297mm;
+    overflow: hidden;
+    page-break-after: always;
+}
+.cover-image {
+    position: absolute;
+    top: 0;
+    left: 0;
+    width: 100%;
+    height: 100%;
+    object-fit: cover;
+}
+.dark-overlay {
+    position: absolute;
+    top: 0; left: 0; right: 0; bottom: 0;
+    background-color: rgba(0, 0, 0, 0.2);
+}
+.title-page {
+    position: absolute;
+    bottom: 0; left: 0; right: 0;
+    padding: 32px;
+    box-sizing: border-box;
+}
+.content-section {
+    page: content;
+}
+"""
+
+BOOK_STYLESHEET = COVER_CSS + BOOK_CSS
+
+_weasyprint = None
+_weasyprint_error = None
+_stylesheets = None
+_load_lock = threading.Lock()
+_render_pool = None
+_pool_lock = threading.Lock()
+
+# Filled in by warm_up(); served on /startup
+STARTUP_REPORT: dict = {}
+
+
+def _patch_find_library() -> None:
+    """Lets cffi find the WeasyPrint system libraries symlinked into WEASYPRINT_LIB_DIR."""
+    import ctypes.util
+
+    lib_dir = os.environ.get("WEASYPRINT_LIB_DIR", "/app/.libs")
+    if not (lib_dir and os.path.isdir(lib_dir)):
+        return
+
+    original_find_library = ctypes.util.find_library
+    # Scan the directory once instead of on every lookup
+    lib_files = sorted(os.listdir(lib_dir))
+
+    def patched_find_library(name: str):
+        direct = os.path.join(lib_dir, name)
+        if os.path.exists(direct):
+            return direct
+        bases = [
+            name,
+            f"lib{name}",
+            f"lib{name}-0",
+            f"lib{name}-1",
+            f"{name}-0",
+            f"{name}-1",
+        ]
+        for base in bases:
+            for suffix in ("", ".so", ".so.0", ".so.1", ".so.2"):
+                candidate = os.path.join(lib_dir, f"{base}{suffix}")
+                if os.path.exists(candidate):
+                    return candidate
+        for fname in lib_files:
+            if name in fname:
+                return os.path.join(lib_dir, fname)
+        return original_find_library(name)
+
+    ctypes.util.find_library = patched_find_library
+
+
+def load_weasyprint():
+    """Imports WeasyPrint once per process and returns the module.
+
+    Raises RuntimeError if the import failed (usually missing system libraries);
+    the failure is remembered so later calls don't retry the slow import.
+    """
+    global _weasyprint, _weasyprint_error
+    with _load_lock:
+        if _weasyprint is None and _weasyprint_error is None:
+            try:
+                _patch_find_library()
+                import weasyprint
+                _weasyprint = weasyprint
+            except Exception as e:
+                _weasyprint_error = e
+    if _weasyprint_error is not None:
+        raise RuntimeError(f"WeasyPrint import failed: {_weasyprint_error}")
+    return _weasyprint
+
+
+def book_stylesheets() -> list:
+    """The book stylesheet, parsed once and shared by every render."""
+    global _stylesheets
+    weasyprint = load_weasyprint()
+    with _load_lock:
+        if _stylesheets is None:
+            _stylesheets = [weasyprint.CSS(string=BOOK_STYLESHEET)]
+    return _stylesheets
+
+
+def warm_up() -> dict:
+    """Loads WeasyPrint and warms up the renderer (worker pool or this process).
+
+    Meant to run once at application startup so the first book request doesn't
+    pay for library resolution, font discovery, CSS parsing or worker start-up.
+    """
+    report = {}
+    try:
+        started = time.perf_counter()
+        load_weasyprint()
+        report["weasyprint_import"] = round(time.perf_counter() - started, 3)
+
+        if RENDER_WORKERS > 0:
+            started = time.perf_counter()
+            workers = start_render_pool()
+            report["render_pool"] = round(time.perf_counter() - started, 3)
+            report["render_workers"] = workers
+        else:
+            report.update(_warm_renderer())
+        report["ready"] = True
+    except Exception as e:
+        logger.error(f"Renderer warm-up failed: {e}")
+        report["ready"] = False
+        report["error"] = str(e)
+    STARTUP_REPORT.update(report)
+    return report
+
+
+def _warm_renderer() -> dict:
+    """Parses the stylesheets and renders a probe page in this process."""
+    weasyprint = load_weasyprint()
+    report = {}
+    started = time.perf_counter()
+    stylesheets = book_stylesheets()
+    report["stylesheets"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    weasyprint.HTML(string="<h1>Warm-up</h1><p>Ready.</p>").write_pdf(stylesheets=stylesheets)
+    report["probe_render"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _init_render_worker() -> None:
+    try:
+        _warm_renderer()
+    except Exception as e:
+        # Renders will raise the same error to the caller
+        logger.error(f"Render worker warm-up failed: {e}")
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                # fork would copy the API process's threads and locks
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_render_worker,
+                max_tasks_per_child=RENDER_MAX_TASKS,
+            )
+        return _render_pool
+
+
+def start_render_pool() -> int:
+    """Starts (and warms) every render worker; returns how many are up."""
+    pool = get_render_pool()
+    # Workers are spawned on demand, one per task no idle worker can take
+    futures = [pool.submit(_worker_pid) for _ in range(RENDER_WORKERS)]
+    return len({future.result() for future in futures})
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    with _pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _write_pdf(document: str, base_url: str, output_path: str, max_pages: int | None = None) -> float:
+    """Renders one document to ``output_path``; returns the seconds write_pdf took.
+
+    With ``max_pages`` only the first pages of the layout are written.
+    Runs in a render worker (or in-process when RENDER_WORKERS is 0).
+    """
+    weasyprint = load_weasyprint()
+    started = time.perf_counter()
+    html = weasyprint.HTML(string=document, base_url=base_url, url_fetcher=_local_url_fetcher())
+    if max_pages:
+        rendered = html.render(stylesheets=book_stylesheets(), presentational_hints=True)
+        rendered.copy(rendered.pages[:max_pages]).write_pdf(output_path)
+    else:
+        html.write_pdf(
+            output_path,
+            stylesheets=book_stylesheets(),
+            presentational_hints=True
+        )
+    return time.perf_counter() - started
+
+
+def _local_url_fetcher():
+    """WeasyPrint URL fetcher that only reads local files and data: URIs.
+
+    Every image is localized (within the fetch limits) before rendering; a
+    remote URL left in the HTML is skipped rather than downloaded unchecked.
+    """
+    weasyprint = load_weasyprint()
+    if hasattr(weasyprint, "URLFetcher"):
+        # WeasyPrint 68+: fetchers are URLFetcher instances (70 dropped the
+        # function-style default_url_fetcher)
+        return weasyprint.URLFetcher(allowed_protocols=("file", "data"))
+    return _legacy_local_url_fetcher
+
+
+def _legacy_local_url_fetcher(url: str, *args, **kwargs) -> dict:
+    """Function-style fetcher for WeasyPrint releases before 68."""
+    if not url.startswith(("file:", "data:")):
+        raise ValueError(f"remote resource not fetched while rendering: {url}")
+    return load_weasyprint().default_url_fetcher(url, *args, **kwargs)
+
+
+def _run_renders(jobs: list[tuple]) -> None:
+    """Renders ``(document, base_url, output_path[, max_pages])`` jobs, in parallel on the pool."""
+    for seconds in _run_in_workers(_write_pdf, jobs):
+        observe_stage("write_pdf", seconds)
+
+
+def _run_in_workers(fn, jobs: list[tuple]) -> list:
+    """``[fn(*job) for job in jobs]``, run in parallel on the render workers."""
+    if RENDER_WORKERS <= 0:
+        return [fn(*job) for job in jobs]
+
+    for attempt in (1, 2):
+        pool = get_render_pool()
+        try:
+            futures = [pool.submit(fn, *job) for job in jobs]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool once
+            _discard_pool(pool)
+            if attempt == 2:
+                raise
+            logger.warning("Render worker died, restarting the render pool")
+
+
+def fragment_document(body: str) -> str:
+    """Wraps one book section (cover or chapter) into a standalone HTML document."""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+    </head>
+    <body>
+        {body}
+    </body>
+    </html>
+    """
+
+
+def render_document(document: str, output_path: str, base_url: str) -> None:
+    """Renders a full HTML document to ``output_path`` with the book stylesheet."""
+    _run_renders([(document, base_url, output_path)])
+
+
+def render_fragments(documents: list[str], base_url: str, max_pages: int | None = None) -> list[str]:
+    """Cached fragment PDF paths for ``documents``, rendering the misses in parallel.
+
+    Image references in the book HTML are content-addressed file names, so the
+    document text alone identifies the rendered output. ``max_pages`` keeps
+    only the first pages of each fragment (previews).
+    """
+    weasyprint = load_weasyprint()
+    suffix = f"\n{max_pages}" if max_pages else ""
+    keys = [
+        hashlib.sha256(f"{weasyprint.__version__}\n{BOOK_STYLESHEET}\n{document}{suffix}".encode("utf-8")).hexdigest()
+        for document in documents
+    ]
+    paths = {key: fragment_cache.path(key) for key in keys}
+
+    # Workers write straight into the cache directory; the files are then
+    # renamed into place
+    pending = {}
+    for key, document in zip(keys, documents):
+        if paths[key] is None and key not in pending:
+            pending[key] = (document, base_url, fragment_cache.temp_path(".pdf"), max_pages)
+    try:
+        _run_renders(list(pending.values()))
+        for key, (_, _, output_path, _) in pending.items():
+            paths[key] = fragment_cache.set_file(key, output_path)
+    finally:
+        for _, _, output_path, _ in pending.values():
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    return [paths[key] for key in keys]
+
+
+@stage("assemble_pdf")
+def assemble_pdf(fragment_paths: list[str], output_path: str) -> None:
+    """Concatenates fragment PDFs (keeping their outlines) into ``output_path``."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for path in fragment_paths:
+        writer.append(path)
+    # Write next to the target first so a failed write never leaves half a book
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf", dir=os.path.dirname(output_path) or None)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+        os.replace(tmp_path, output_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    finally:
+        writer.close()
+
+
+def optimize_pdf(path: str) -> dict:
+    """Runs the optimization pass over the PDF at ``path`` (on a render worker).
+
+    The file is only replaced if the result is smaller. Returns
+    ``{"bytesBefore": ..., "bytesAfter": ...}``.
+    """
+    with stage("pdf_optimize"):
+        before, after = _run_in_workers(_optimize_file, [(path,)])[0]
+    logger.info(f"PDF optimization saved {before - after} of {before} bytes on {os.path.basename(path)}")
+    return {"bytesBefore": before, "bytesAfter": after}
+
+
+def _optimize_file(path: str) -> tuple[int, int]:
+    from pypdf import PdfWriter
+
+    before = os.path.getsize(path)
+    writer = PdfWriter(clone_from=path)
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf", dir=os.path.dirname(path) or None)
+    try:
+        for page in writer.pages:
+            page.compress_content_streams()
+        # Drops byte-identical duplicates (same image/font embedded by several
+        # fragments) and objects nothing references any more
+        writer.compress_identical_objects()
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+
+        after = os.path.getsize(tmp_path)
+        if after < before:
+            os.replace(tmp_path, path)
+            return before, after
+        return before, before
+    finally:
+        writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
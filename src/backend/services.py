@@ -1,21 +1,45 @@
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from newspaper import Article
 import logging
-from openai import OpenAI
-import requests
+import asyncio
 import base64
 import html
 import subprocess
 import tempfile
-from readability import Document
 import html as htmlparser
 import ftfy
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import lxml.html
+from urllib.parse import urlparse
 import hashlib
 import shutil
+import json
+import threading
+import random
+import re
+import weakref
+import contextvars
+from typing import TYPE_CHECKING
+from cache import DiskCache
+from fetcher import (
+    fetch_scheduler, HostQueueExecutor, book_budget, ByteBudget, check_response_headers, count_body_bytes,
+    book_deadline, Deadline, deadline_passed,
+    FETCH_MAX_CONNECTIONS, FETCH_PER_HOST, FETCH_MAX_PAGE_BYTES, FETCH_MAX_IMAGE_BYTES, BOOK_MAX_DOWNLOAD_BYTES,
+    PAGE_CONTENT_TYPES, IMAGE_CONTENT_TYPES,
+)
+from metrics import stage, upstream, in_context
+from renderer import (
+    BOOK_STYLESHEET, BOOK_RENDER_MODE, load_weasyprint, fragment_document, render_fragments,
+    render_document, assemble_pdf, optimize_pdf, PDF_OPTIMIZE,
+)
+from images import (
+    ImageStore, ImageTooLarge, image_ext, prepare_for_print, print_variant, print_width_px,
+    select_image_source, is_decorative_image, enclosing_picture, LAZY_SRC_ATTRS, LAZY_SRCSET_ATTRS,
+    CONTENT_WIDTH_MM, COVER_WIDTH_MM,
+)
+
+if TYPE_CHECKING:
+    import httpx
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,235 +55,963 @@ if dotenv_path.exists():
 # Access the key
 OPENAI_API_KEY = os.getenv("VITE_OPENAI_API_KEY")
 
-# Initialize OpenAI Client
-client = None
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
+# Timeouts for upstream calls made from the request/response endpoints
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "20"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+
+if not OPENAI_API_KEY:
     logger.warning("VITE_OPENAI_API_KEY not found in environment variables.")
 
-def generate_book_cover(prompt: str) -> str:
-    """Generates a book cover image using OpenAI DALL-E 3 based on the prompt."""
-    if not client:
+# OpenAI client shared by the endpoints. The openai package is slow to
+# import, so it is created on first use.
+_async_client = None
+
+def get_async_openai_client():
+    global _async_client
+    if _async_client is None and OPENAI_API_KEY:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    return _async_client
+
+async def generate_book_cover_async(prompt: str) -> str:
+    """Generates (or reuses) a cover for ``prompt`` and returns its asset path.
+
+    The image is requested as base64 and stored right away in the local cover
+    store, so it never depends on DALL-E's expiring URL and rendering never goes
+    back to the network for it. Identical requests are deduplicated through the
+    store's index, keyed by a hash of the generation parameters.
+    """
+    async_client = get_async_openai_client()
+    if not async_client:
         raise Exception("OpenAI client not initialized. check VITE_OPENAI_API_KEY.")
-        
-    try:
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
 
-        image_url = response.data[0].url
-        return image_url
+    params = cover_request(prompt)
+    prompt_key = "prompt:" + hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    stored = cover_store.lookup(prompt_key)
+    if stored:
+        logger.info("Reusing stored cover for identical prompt")
+        return COVER_ASSET_PATH + stored[1]
+
+    try:
+        with upstream("openai_image"):
+            response = await async_client.images.generate(**params, response_format="b64_json")
+        content = base64.b64decode(response.data[0].b64_json)
+        with stage("image_prepare"):
+            content, ext = await asyncio.to_thread(
+                prepare_for_print, content, ".png", print_width_px(COVER_WIDTH_MM)
+            )
+        _, name = cover_store.put(prompt_key, content, ext)
+        return COVER_ASSET_PATH + name
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error generating book cover: {e}")
         # Fallback to placeholder if generation fails (e.g., content policy violation)
-        return "https://placehold.co/600x400?text=Cover+Generation+Failed"
+        return COVER_FALLBACK_URL
+
+def cover_asset_name(url: str) -> str | None:
+    """Stored cover file name referenced by ``url`` (any host), or None."""
+    match = COVER_ASSET_RE.search(urlparse(url).path)
+    return match.group(1) if match else None
+
+COVER_FALLBACK_URL = "https://placehold.co/600x400?text=Cover+Generation+Failed"
+
+# Generated covers live in their own store so chapter images can't evict them
+COVER_STORE_MAX_BYTES = int(os.getenv("COVER_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+cover_store = ImageStore("covers", max_bytes=COVER_STORE_MAX_BYTES)
+COVER_ASSET_PATH = "/assets/covers/"
+COVER_ASSET_RE = re.compile(r"/assets/covers/([0-9a-f]{64}\.[a-z]{2,4})$")
+
+def cover_request(prompt: str) -> dict:
+    return {
+        "model": "dall-e-3",
+        "prompt": prompt,
+        "size": "1024x1024",
+        "quality": "standard",
+        "n": 1,
+    }
+
+async def fetch_article_content_async(url: str) -> dict:
+    """Fetches article content using newspaper3k.
 
-def fetch_article_content(url: str) -> dict:
-    """Fetches article content using newspaper3k."""
+    The page is downloaded with the pooled async HTTP client and handed to
+    newspaper3k; parsing (CPU-bound) runs in a worker thread.
+    """
     try:
         logger.info(f"Fetching article from: {url}")
-        article = Article(url)
-        article.download()
-        article.parse()
-        
-        # Optional: Perform NLP to get keywords/summary if needed
-        # article.nlp() 
+        with upstream("article"):
+            status_code, headers, html_content = await download_page_async(url)
+        if status_code >= 400:
+            raise Exception(f"Article download failed with {status_code} for url {url}")
 
-        media = []
-        if article.top_image:
-            media.append({"type": "image", "url": article.top_image})
-        
-        for img_url in article.images:
-             if img_url != article.top_image:
-                 media.append({"type": "image", "url": img_url})
-
-        return {
-            "title": article.title,
-            "content": article.text,
-            "media": media,
-            "success": True
-        }
+        from newspaper import Article
+        article = Article(url)
+        article.download(input_html=html_content)
+        return await asyncio.to_thread(parse_and_store_article, article, url, html_content, headers)
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching article: {e}")
         return {"error": str(e), "success": False}
 
-def generate_chapter_summary(title: str, content: str) -> str:
-    """Generates a summary of the chapter using OpenAI GPT-4o."""
-    if not client:
+async def download_page_async(url: str) -> tuple[int, "httpx.Headers", str]:
+    """Streams a page with the pooled async client, within FETCH_MAX_PAGE_BYTES."""
+    async with get_async_http().stream("GET", url) as resp:
+        check_response_headers(resp.status_code, resp.headers, FETCH_MAX_PAGE_BYTES, PAGE_CONTENT_TYPES)
+        received = 0
+        chunks = []
+        async for chunk in resp.aiter_bytes():
+            received = count_body_bytes(received, len(chunk), FETCH_MAX_PAGE_BYTES)
+            chunks.append(chunk)
+        encoding = resp.encoding or "utf-8"
+        return resp.status_code, resp.headers, b"".join(chunks).decode(encoding, errors="replace")
+
+def parse_and_store_article(article, url: str, html_content: str, headers=None) -> dict:
+    """Parses a downloaded article and keeps the page in the server-side article store.
+
+    The returned ``articleId`` lets the book build reuse this copy instead of
+    downloading the page a second time.
+    """
+    article.parse()
+    result = article_result(article)
+    try:
+        result["articleId"] = store_article(url, html_content, result, headers)
+    except Exception as e:
+        logger.warning(f"Could not store article {url}: {e}")
+        result["articleId"] = None
+    return result
+
+def article_result(article) -> dict:
+    media = []
+    if article.top_image:
+        media.append({"type": "image", "url": article.top_image})
+    
+    for img_url in article.images:
+         if img_url != article.top_image:
+             media.append({"type": "image", "url": img_url})
+
+    return {
+        "title": article.title,
+        "content": article.text,
+        "media": media,
+        "success": True
+    }
+
+async def generate_chapter_summary_async(title: str, content: str) -> str:
+    """Summarizes a chapter; the endpoints call this directly.
+
+    Content that fits in one SUMMARY_CHUNK_TOKENS budget is summarized in a
+    single call. Longer content is split into chunks that are summarized in
+    parallel and then merged by a final reduce call, so latency stays roughly
+    flat as articles grow. Every call is cached by model + prompt and shares a
+    bounded number of OpenAI slots (SUMMARY_CONCURRENCY) with backoff on rate
+    limits.
+    """
+    if not get_async_openai_client():
         return "OpenAI client not initialized."
 
     try:
-        prompt = f"Summarize the following article titled '{title}' in a concise paragraph suitable for a book chapter summary:\n\n{content[:5000]}" # Truncate to avoid token limits
-        
-        completion = client.chat.completions.create(
-            model="gpt-4o", 
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that summarizes articles for book chapters."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        summary = completion.choices[0].message.content
+        chunks = split_into_chunks(content, SUMMARY_CHUNK_TOKENS)
+        if len(chunks) <= 1:
+            summary = await _summarize(summary_messages(title, content))
+        else:
+            partials = await asyncio.gather(*(
+                _summarize(chunk_summary_messages(title, chunk)) for chunk in chunks
+            ))
+            if not all(partials):
+                return "Summary generation failed."
+            summary = await _summarize(reduce_summary_messages(title, partials))
         return summary if summary else "Summary generation failed."
 
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
         return "Failed to generate summary."
 
+async def _summarize(messages: list[dict]) -> str | None:
+    """One cached, rate-limited chat completion."""
+    cache_key = hashlib.sha256(json.dumps([SUMMARY_MODEL, messages]).encode("utf-8")).hexdigest()
+    cached = summary_cache.get(cache_key)
+    if cached:
+        return cached[0].decode("utf-8")
+
+    async_client = get_async_openai_client()
+    async with _summary_slots():
+        with upstream("openai_chat"):
+            completion = await _with_rate_limit_backoff(
+                lambda: async_client.with_options(max_retries=0).chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=messages
+                )
+            )
+
+    summary = completion.choices[0].message.content
+    if summary:
+        summary_cache.set(cache_key, summary.encode("utf-8"))
+    return summary
+
+def split_into_chunks(content: str, max_tokens: int) -> list[str]:
+    """Splits text into paragraph-aligned chunks of at most ~``max_tokens`` tokens.
+
+    Cut points depend on the paragraphs themselves (a paragraph whose hash hits
+    a marker ends a chunk once it is half full), not on absolute offsets, so
+    editing one part of an article leaves the other chunks, and their cached
+    summaries, unchanged.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        paragraph = paragraph.strip()
+        # Oversized paragraphs are hard-split so no chunk blows the budget
+        while len(paragraph) > max_chars:
+            paragraphs.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    chunks, current, size = [], [], 0
+    for paragraph in paragraphs:
+        if current and size + len(paragraph) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+        marker = int(hashlib.md5(paragraph.encode("utf-8")).hexdigest()[:8], 16) % 4 == 0
+        if marker and size >= max_chars // 2:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+async def generate_chapter_summaries_async(chapters: list[dict]) -> list[dict]:
+    """Summarizes every chapter of a book concurrently, in chapter order."""
+    summaries = await asyncio.gather(*(
+        generate_chapter_summary_async(chapter["title"], chapter["content"]) for chapter in chapters
+    ))
+    return [
+        {"id": chapter.get("id"), "summary": summary}
+        for chapter, summary in zip(chapters, summaries)
+    ]
+
+# Concurrent OpenAI summary calls per process; keep under the account's rate limit
+SUMMARY_MODEL = "gpt-4o"
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "5"))
+# Long articles are summarized map-reduce style in chunks of about this many tokens
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+CHARS_PER_TOKEN = 4
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+summary_cache = DiskCache("summaries", max_bytes=SUMMARY_CACHE_MAX_BYTES)
+
+# asyncio primitives are bound to one event loop, so keep a semaphore per loop
+_summary_semaphores = weakref.WeakKeyDictionary()
+def _summary_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _summary_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _summary_semaphores[loop] = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    return semaphore
+
+async def _with_rate_limit_backoff(call):
+    """Retries an OpenAI call on 429s, honoring Retry-After, else jittered exponential backoff."""
+    from openai import RateLimitError
+
+    for attempt in range(SUMMARY_MAX_RETRIES + 1):
+        try:
+            return await call()
+        except RateLimitError as e:
+            if attempt == SUMMARY_MAX_RETRIES:
+                raise
+            retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"OpenAI rate limited, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+SUMMARY_SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful assistant that summarizes articles for book chapters."}
+
+def summary_messages(title: str, content: str) -> list[dict]:
+    prompt = f"Summarize the following article titled '{title}' in a concise paragraph suitable for a book chapter summary:\n\n{content}"
+    return [SUMMARY_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+def chunk_summary_messages(title: str, chunk: str) -> list[dict]:
+    prompt = f"The following is one part of a longer article titled '{title}'. Summarize the key points of this part in a few sentences:\n\n{chunk}"
+    return [SUMMARY_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+def reduce_summary_messages(title: str, partials: list[str]) -> list[dict]:
+    parts = "\n\n".join(f"Part {i}: {partial}" for i, partial in enumerate(partials, 1))
+    prompt = f"Below are summaries of consecutive parts of an article titled '{title}'. Combine them into one concise paragraph suitable for a book chapter summary:\n\n{parts}"
+    return [SUMMARY_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+# Pooled async HTTP client for the endpoints (one per process, closed on shutdown)
+_async_http = None
+def get_async_http() -> "httpx.AsyncClient":
+    global _async_http
+    if _async_http is None:
+        import httpx
+        _async_http = httpx.AsyncClient(
+            timeout=UPSTREAM_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            headers={"User-Agent": "Mozilla/5.0 (compatible; ContentBookify/1.0)"},
+        )
+    return _async_http
+
+async def close_async_clients() -> None:
+    global _async_http, _async_client
+    if _async_http is not None:
+        await _async_http.aclose()
+        _async_http = None
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
 
 # --- Book Builder Logic ---
 
-BOOK_CSS = """
-@page {
-  size: A4;
-  margin: 2cm;
-}
+# Upper bound on chapters fetched/cleaned at the same time for one book
+CHAPTER_WORKERS = int(os.getenv("CHAPTER_WORKERS", "8"))
+
+# Fetched articles (raw HTML + readability output), revalidated after the TTL
+ARTICLE_CACHE_TTL = float(os.getenv("ARTICLE_CACHE_TTL", str(6 * 3600)))
+ARTICLE_CACHE_MAX_BYTES = int(os.getenv("ARTICLE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+article_cache = DiskCache("articles", max_bytes=ARTICLE_CACHE_MAX_BYTES, ttl=ARTICLE_CACHE_TTL)
+
+# Articles fetched through /fetch-article/, addressed by the handle it returned
+ARTICLE_STORE_MAX_BYTES = int(os.getenv("ARTICLE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+article_store = DiskCache("article-store", max_bytes=ARTICLE_STORE_MAX_BYTES)
+
+# Downloaded images (chapter images and covers), shared across builds
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+image_store = ImageStore("images", max_bytes=IMAGE_STORE_MAX_BYTES)
+
+# Finished book PDFs, keyed by book definition + source versions; 0 disables
+BOOK_RESULT_CACHE_MAX_BYTES = int(os.getenv("BOOK_RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+book_cache = DiskCache("books", max_bytes=BOOK_RESULT_CACHE_MAX_BYTES)
+# Bump when a pipeline change alters the output for unchanged inputs
+BOOK_CACHE_VERSION = "1"
+
+# Previews: the cover plus the first PREVIEW_PAGES pages of the first chapter,
+# with cached images only and a small allowance for the remaining downloads
+# (the chapter's page, the cover image)
+PREVIEW_PAGES = int(os.getenv("PREVIEW_PAGES", "3"))
+PREVIEW_MAX_DOWNLOAD_BYTES = int(os.getenv("PREVIEW_MAX_DOWNLOAD_BYTES", str(2 * 1024 * 1024)))
+# Text kept per previewed page, so layout never runs over a whole long chapter
+PREVIEW_CHARS_PER_PAGE = 3000
+
+# Latency budget of a book built for a waiting HTTP request (0 disables it);
+# background jobs and the CLI build without one. Fetching must be done
+# BOOK_RENDER_RESERVE_SECONDS before the end, as rendering can't be cut
+# short. Previews split PREVIEW_DEADLINE_SECONDS the same way, keeping
+# PREVIEW_RENDER_RESERVE_SECONDS for the render. Chapters that aren't finished
+# by then are degraded instead of waited for.
+BOOK_DEADLINE_SECONDS = float(os.getenv("BOOK_DEADLINE_SECONDS", "120"))
+BOOK_RENDER_RESERVE_SECONDS = float(os.getenv("BOOK_RENDER_RESERVE_SECONDS", "30"))
+PREVIEW_DEADLINE_SECONDS = float(os.getenv("PREVIEW_DEADLINE_SECONDS", "2"))
+PREVIEW_RENDER_RESERVE_SECONDS = float(os.getenv("PREVIEW_RENDER_RESERVE_SECONDS", "1"))
+
+# Degradation steps of a chapter that ran out of time, mildest first
+DEGRADED_IMAGES = "images_skipped"
+DEGRADED_CACHED = "cached_copy"
+DEGRADED_PLACEHOLDER = "placeholder"
+
+# Steps applied to the chapter processed in this context (see build_book_pdf)
+_chapter_degradations: contextvars.ContextVar[list | None] = contextvars.ContextVar("chapter_degradations", default=None)
 
-body { font-family: "Georgia"; line-height: 1.55; }
-h1 { page-break-before: always; font-size: 24pt; }
-h2 { font-size: 16pt; margin-top: 1.5em; }
-p  { margin: 0.8em 0; text-align: justify; }
-figure { page-break-inside: avoid; }
-"""
+def note_degraded(step: str) -> None:
+    steps = _chapter_degradations.get()
+    if steps is not None and step not in steps:
+        steps.append(step)
 
+# Parts of the build that failed outright (an image that couldn't be localized,
+# a chapter that errored); such a book is delivered but never cached
+_build_failures: contextvars.ContextVar[list | None] = contextvars.ContextVar("build_failures", default=None)
+
+def note_failed(what: str) -> None:
+    failures = _build_failures.get()
+    if failures is not None:
+        failures.append(what)
+
+@stage("fetch_clean")
 def fetch_clean(url):
+    """Fetches ``url`` and returns its readable content as partial HTML, via the article cache.
+
+    Fresh cache entries are served without touching the network; stale ones are
+    revalidated with a conditional GET so an unchanged page costs a 304. A
+    stale copy is also used when the page can't be fetched (or the book's
+    deadline has passed).
+    """
+    cached = article_cache.get(url)
+    if cached:
+        data, meta = cached
+        entry = json.loads(data)
+        if article_cache.is_fresh(meta):
+            return entry["clean"]
+        if deadline_passed():
+            note_degraded(DEGRADED_CACHED)
+            return entry["clean"]
+
+    headers = {}
+    if cached:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
     try:
-        html_content = requests.get(url, timeout=20).text
+        with upstream("article"):
+            resp = fetch_scheduler.get(
+                url, timeout=20, headers=headers,
+                max_bytes=FETCH_MAX_PAGE_BYTES, content_types=PAGE_CONTENT_TYPES,
+            )
+            # Error pages (404, a 503 after retries, ...) are never chapter text
+            if resp.status_code != 200 and not (resp.status_code == 304 and cached):
+                raise ValueError(f"HTTP {resp.status_code}")
     except Exception as e:
         logger.error(f"Failed to fetch {url}: {e}")
+        if cached:
+            logger.info(f"Using the stale cached copy of {url}")
+            note_degraded(DEGRADED_CACHED)
+            return entry["clean"]
         return ""
-        
-    main = Document(html_content).summary(html_partial=True)
 
-    return f"""
-    <html>
-    <head><meta charset="utf-8"></head>
-    <body>{main}</body>
-    </html>
+    if resp.status_code == 304 and cached:
+        logger.info(f"Article not modified, reusing cached copy: {url}")
+        article_cache.update_meta(url, digest=content_digest(entry["clean"]))
+        return entry["clean"]
+
+    html_content = resp.text
+    from readability import Document
+    with stage("readability"):
+        main = Document(html_content).summary(html_partial=True)
+
+    article_cache.set(
+        url,
+        json.dumps({"html": html_content, "clean": main}).encode("utf-8"),
+        {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "digest": content_digest(main),
+        },
+    )
+    return main
+
+def store_article(url, html_content, result, headers=None):
+    """Persists a fetched page (raw HTML + extractions) and returns its handle.
+
+    Also seeds the URL-keyed article cache, so builds for chapters without a
+    handle skip the download too.
+    """
+    from readability import Document
+    with stage("readability"):
+        clean = Document(html_content).summary(html_partial=True)
+    article_id = hashlib.sha256(f"{url}\n{html_content}".encode("utf-8")).hexdigest()[:32]
+    headers = headers or {}
+
+    article_store.set(
+        article_id,
+        json.dumps({
+            "url": url,
+            "html": html_content,
+            "clean": clean,
+            "title": result.get("title"),
+            "content": result.get("content"),
+            "media": result.get("media"),
+        }).encode("utf-8"),
+        {"url": url},
+    )
+    article_cache.set(
+        url,
+        json.dumps({"html": html_content, "clean": clean}).encode("utf-8"),
+        {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "digest": content_digest(clean),
+        },
+    )
+    return article_id
+
+def content_digest(text: str) -> str:
+    """Version of a cleaned article, as used in book result cache keys."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_stored_article(article_id):
+    """Readable HTML of an article fetched earlier by /fetch-article/, or None."""
+    cached = article_store.get(article_id)
+    if not cached:
+        return None
+    return json.loads(cached[0])["clean"]
+
+@stage("clean_chapter")
+def clean_chapter_html(main_html, title, base_url, temp_dir, progress=None, preview_pages=None):
+    """Turns readability output into book HTML on a single lxml tree.
+
+    Unicode repair, image localization and body extraction all work on the
+    same parsed tree, which is serialized exactly once at the end. For a
+    preview (``preview_pages``) the text is cut to roughly that many pages
+    first and only already stored images are used.
     """
+    root = lxml.html.document_fromstring(main_html)
+    body = root.find("body")
+    if body is None:
+        body = root
+    if preview_pages:
+        truncate_tree(body, preview_pages * PREVIEW_CHARS_PER_PAGE)
+
+    with stage("ftfy"):
+        repair_unicode(body)
+    with stage("localize_images"):
+        localize_images(body, base_url, temp_dir, progress, cached_only=bool(preview_pages))
+
+    body.tag = "div"
+    body.attrib.clear()
+    content = lxml.html.tostring(body, encoding="unicode")
+    return f"<h1>{html.escape(title)}</h1>\n{content}"
+
+def truncate_tree(tree, max_chars):
+    """Drops the blocks of ``tree`` that follow its first ``max_chars`` of text."""
+    # Readability nests the whole article in wrapper divs; cut among the blocks
+    node = tree
+    while len(node) == 1:
+        node = node[0]
+    seen = 0
+    for child in list(node):
+        if seen >= max_chars:
+            node.remove(child)
+        else:
+            seen += len(child.text_content())
 
-def localize_images(html_content, base_url, temp_dir):
-    """Localize images with parallel downloads for speed."""
-    soup = BeautifulSoup(html_content, "html.parser")
+def localize_images(tree, base_url, temp_dir, progress=None, cached_only=False):
+    """Localize images (in place on an lxml tree) with parallel downloads for speed.
+
+    Each image is fetched once, from its smallest ``srcset``/``<picture>``
+    candidate that still covers the print width; tracking pixels and
+    decorative images are dropped without being requested. With
+    ``cached_only`` nothing is downloaded: images missing from the image store
+    become placeholders.
+    """
     images_dir = os.path.join(temp_dir, "images")
     os.makedirs(images_dir, exist_ok=True)
+    min_width_px = print_width_px(CONTENT_WIDTH_MM)
 
-    # Collect all images to download
-    img_tasks = []
-    for img in soup.find_all("img"):
-        src = img.get("src")
-        if not src:
+    # Collect all images to download, by URL
+    img_tasks = {}
+    for img in list(tree.iter("img")):
+        abs_url = select_image_source(img, base_url, min_width_px)
+        if not abs_url:
+            continue
+        if is_decorative_image(img, abs_url):
+            img.drop_tree()
             continue
-        abs_url = urljoin(base_url, src)
-        ext = os.path.splitext(src)[-1] or ".jpg"
-        if '?' in ext:
-            ext = ext.split('?')[0]
-        name = hashlib.md5(abs_url.encode()).hexdigest() + ext
-        path = os.path.join(images_dir, name)
-        img_tasks.append((img, abs_url, path, name))
-
-    # Parallel download (max 5 concurrent)
-    def download_and_save(task):
-        img, abs_url, path, name = task
-        if not os.path.exists(path):
-            content = download_image_fast(abs_url)
-            if content:
-                with open(path, "wb") as f:
-                    f.write(content)
-        return (img, name, os.path.exists(path))
-
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        results = list(executor.map(download_and_save, img_tasks))
-
-    # Update img sources
-    for img, name, success in results:
-        if success:
-            img["src"] = f"images/{name}"
-
-    return str(soup)
-
-def repair_unicode(html_content):
-    return ftfy.fix_text(html_content)
+        if abs_url.startswith("data:"):
+            continue
+        img_tasks.setdefault(abs_url, []).append(img)
+    if progress:
+        progress.add_total("images", len(img_tasks))
 
-def normalize_unicode(html_content):
-    return htmlparser.unescape(html_content)
+    # Parallel download on the shared image pool, queued per host; the fetch
+    # scheduler applies the per-host and global connection limits
+    def download_and_save(abs_url):
+        # Past the deadline, queued downloads only take what is already stored
+        name = localize_image_url(abs_url, images_dir, cached_only=cached_only or deadline_passed())
+        if progress:
+            progress.advance("images")
+        return (abs_url, name)
+
+    if cached_only:
+        # Store lookups are quick local reads; don't queue them behind other
+        # builds' downloads on the pool
+        results = [download_and_save(abs_url) for abs_url in img_tasks]
+    else:
+        download = in_context(download_and_save)
+        futures = [_image_executor.submit(urlparse(abs_url).netloc, download, abs_url) for abs_url in img_tasks]
+        results = [future.result() for future in futures]
+
+    # Point each img at its local copy; WeasyPrint only reads src. Images that
+    # couldn't be localized (rejected, failed, out of time) are dropped: the
+    # renderer never goes to the network for them.
+    for abs_url, name in results:
+        if not name:
+            if cached_only:
+                for img in img_tasks[abs_url]:
+                    replace_with_placeholder(img)
+                continue
+            if deadline_passed():
+                note_degraded(DEGRADED_IMAGES)
+            else:
+                note_failed(abs_url)
+            for img in img_tasks[abs_url]:
+                drop_image(img)
+            continue
+        for img in img_tasks[abs_url]:
+            img.set("src", f"images/{name}")
+            for attr in ("srcset", "sizes") + LAZY_SRC_ATTRS + LAZY_SRCSET_ATTRS:
+                img.attrib.pop(attr, None)
+            unwrap_picture(img)
+
+def unwrap_picture(img):
+    """Replaces the ``<picture>`` around ``img`` (and its ``<source>`` elements) with ``img``."""
+    picture = enclosing_picture(img)
+    if picture is None or picture.getparent() is None:
+        return
+    img.tail = picture.tail
+    picture.getparent().replace(picture, img)
 
-def normalize_to_book_html(html_content, title, temp_dir):
-    """Normalize HTML content - skip pandoc for speed, use direct processing."""
-    # Extract just the body content if full HTML
-    soup = BeautifulSoup(html_content, "html.parser")
-    body = soup.find('body')
-    content = str(body) if body else html_content
+def drop_image(img):
+    """Removes ``img`` (and its ``<picture>``), keeping the text around it."""
+    unwrap_picture(img)
+    img.drop_tree()
 
-    # Clean up common issues
-    content = ftfy.fix_text(content)
+def replace_with_placeholder(img):
+    """Swaps ``img`` (and its ``<picture>``) for a light box with its alt text."""
+    unwrap_picture(img)
+    placeholder = lxml.html.Element("div", {"class": "image-placeholder"})
+    placeholder.text = img.get("alt") or "Image"
+    placeholder.tail = img.tail
+    img.getparent().replace(img, placeholder)
 
-    return f"<h1>{html.escape(title)}</h1>\n<div>{content}</div>"
+def localize_image_url(abs_url, images_dir, width_mm=CONTENT_WIDTH_MM, cached_only=False):
+    """Places the image at ``abs_url`` into ``images_dir`` via the shared image store.
+
+    The stored copy is already downsampled for a printed width of ``width_mm``.
+    Returns the local file name, or None if the image could not be fetched (or,
+    with ``cached_only``, isn't stored yet).
+    """
+    max_width_px = print_width_px(width_mm)
+    variant = print_variant(max_width_px)
+    stored = image_store.lookup(abs_url, variant)
+    if stored and image_store.link(stored[0], images_dir, stored[1]):
+        return stored[1]
+    if cached_only:
+        return None
+
+    # The download goes to disk and is decoded from there, so an image's raw
+    # bytes are never held in memory
+    fd, download_path = tempfile.mkstemp(suffix=".part", dir=images_dir)
+    os.close(fd)
+    try:
+        if not download_image_fast(abs_url, download_path):
+            return None
+        with stage("image_prepare"):
+            content, ext = prepare_for_print(download_path, image_ext(abs_url), max_width_px)
+    except ImageTooLarge as e:
+        logger.warning(f"Skipping image {abs_url}: {e}")
+        return None
+    finally:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+    blob_path, name = image_store.put(abs_url, content, ext, variant)
+    if image_store.link(blob_path, images_dir, name):
+        return name
+    return None
+
+def repair_unicode(tree):
+    """Runs ftfy over text nodes only, leaving markup and attributes alone."""
+    for el in tree.iter():
+        for attr in ("text", "tail"):
+            text = getattr(el, attr)
+            # Pure-ASCII text has nothing for ftfy to repair
+            if text and not text.isascii():
+                setattr(el, attr, ftfy.fix_text(text, unescape_html=False))
+
+def normalize_unicode(html_content):
+    return htmlparser.unescape(html_content)
 
 from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
-# Reusable session for connection pooling
-_session = None
-def get_session():
-    global _session
-    if _session is None:
-        _session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
-        _session.mount('http://', adapter)
-        _session.mount('https://', adapter)
-    return _session
-
-def download_image_fast(url, timeout=10):
-    """Fast image download with connection pooling."""
+# Image downloads for every chapter of every book share one pool; each host
+# gets at most FETCH_PER_HOST of its workers
+_image_executor = HostQueueExecutor(FETCH_MAX_CONNECTIONS, FETCH_PER_HOST, thread_name_prefix="image-fetch")
+
+def download_image_fast(url, dest_path, timeout=10):
+    """Streams the image at ``url`` to ``dest_path`` through the shared fetch scheduler.
+
+    Returns True on success; oversized and non-image responses are rejected
+    from their headers where possible.
+    """
     try:
-        resp = get_session().get(url, timeout=timeout)
-        if resp.status_code == 200:
-            return resp.content
+        with upstream("image"):
+            resp = fetch_scheduler.get(
+                url, timeout=timeout,
+                max_bytes=FETCH_MAX_IMAGE_BYTES, content_types=IMAGE_CONTENT_TYPES, dest=dest_path,
+            )
+        return resp.status_code == 200
     except Exception as e:
         logger.warning(f"Failed to download {url}: {e}")
+    return False
+
+class BuildProgress:
+    """Thread-safe per-stage counters for one book build.
+
+    Stages are reported in pipeline order: ``chapters`` (fetched N/M),
+    ``images`` (localized N/M, the total grows as chapters are cleaned) and
+    ``rendering``. ``version`` increments on every change so pollers can cheaply
+    tell whether anything moved.
+    """
+
+    def __init__(self):
+        self.stage = "queued"
+        self.stages = {}
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def start(self, stage: str, total: int = 0) -> None:
+        with self._lock:
+            self.stage = stage
+            self.stages.setdefault(stage, {"done": 0, "total": 0})["total"] += total
+            self.version += 1
+
+    def add_total(self, stage: str, total: int) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, {"done": 0, "total": 0})["total"] += total
+            self.version += 1
+
+    def advance(self, stage: str, done: int = 1) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, {"done": 0, "total": 0})["done"] += done
+            self.version += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "stage": self.stage,
+                "stages": {name: dict(counts) for name, counts in self.stages.items()},
+            }
+
+def process_chapter(
+    chapter: dict, temp_dir: str, progress: BuildProgress | None = None, preview_pages: int | None = None
+) -> str | None:
+    """Runs one chapter through Fetch -> Clean -> Normalize, returning its book HTML."""
+    url = chapter.get('url')
+    title = chapter.get('title', 'By Unknown')
+
+    if not url:
+        # Fallback to content if URL is missing
+        if chapter.get('content'):
+            return f"<h1>{title}</h1>\n<div>{chapter.get('content')}</div>"
+        return None
+
+    try:
+        # Prefer the copy /fetch-article/ already downloaded
+        article_id = chapter.get('articleId')
+        clean = load_stored_article(article_id) if article_id else None
+        if clean is None:
+            clean = fetch_clean(url)
+        if clean:
+            return clean_chapter_html(clean, title, url, temp_dir, progress, preview_pages)
+        if deadline_passed():
+            note_degraded(DEGRADED_PLACEHOLDER)
+            return chapter_placeholder(title, url)
+        logger.warning(f"Empty content fetched for {url}")
+    except Exception as e:
+        logger.error(f"Error processing chapter {title} ({url}): {e}")
+        note_failed(url)
+        return f"<h1>{title}</h1>\n<p>Error processing content from {url}</p>"
     return None
 
-def generate_book_pdf(book_data: dict) -> dict:
-    """Generates a PDF for the book using the robust Fetch -> Clean -> Normalize pipeline."""
+def chapter_placeholder(title: str, url: str) -> str:
+    """Stand-in for a chapter that couldn't be fetched before the book's deadline."""
+    return (
+        f"<h1>{html.escape(title)}</h1>\n"
+        f'<p>This chapter could not be fetched in time. Read it online at <a href="{html.escape(url)}">{html.escape(url)}</a>.</p>'
+    )
+
+def book_file_name(book_data: dict) -> str:
+    return f"{(book_data.get('title') or 'book').replace(' ', '-').lower()}.pdf"
+
+def book_cache_key(book_data: dict) -> str | None:
+    """Canonical hash of everything that determines a book's PDF, or None.
+
+    Covers the fields that reach the output, the current version of every
+    source (the fresh article cache entry or stored article, and the stored
+    cover image) and the render settings. Returns None while any source has
+    no fresh cached version yet: such a book has to be built (which refreshes
+    its sources) before its result can be reused.
+    """
+    if BOOK_RESULT_CACHE_MAX_BYTES <= 0:
+        return None
+    try:
+        weasyprint_version = load_weasyprint().__version__
+    except Exception:
+        return None
+
+    chapters = []
+    for chapter in book_data.get('chapters') or []:
+        url = chapter.get('url')
+        version = None
+        article_id = chapter.get('articleId')
+        if article_id and article_store.meta(article_id):
+            # Handles are content hashes themselves
+            version = article_id
+        elif url:
+            meta = article_cache.meta(url)
+            if not meta or not article_cache.is_fresh(meta) or not meta.get("digest"):
+                return None
+            version = meta["digest"]
+        chapters.append([chapter.get('title'), url, chapter.get('content'), version])
+
+    cover_url = (book_data.get('coverImage') or {}).get('url')
+    cover_version = None
+    if cover_url:
+        local_path = cover_url[7:] if cover_url.startswith('file://') else cover_url
+        cover_version = cover_asset_name(cover_url)
+        if not cover_version and os.path.isfile(local_path):
+            st = os.stat(local_path)
+            cover_version = [st.st_size, st.st_mtime_ns]
+        elif not cover_version:
+            stored = image_store.lookup(cover_url, print_variant(print_width_px(COVER_WIDTH_MM)))
+            if not stored:
+                return None
+            cover_version = stored[1]
+
+    canonical = {
+        "v": BOOK_CACHE_VERSION,
+        "render": [weasyprint_version, BOOK_STYLESHEET, BOOK_RENDER_MODE, PDF_OPTIMIZE,
+                   print_variant(print_width_px(CONTENT_WIDTH_MM))],
+        "book": [book_data.get(field) for field in ('title', 'subtitle', 'author', 'format', 'coverOptions')],
+        "cover": [cover_url, cover_version],
+        "chapters": chapters,
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def etag_matches(if_none_match: str | None, etag: str | None) -> bool:
+    """Whether an If-None-Match header value matches ``etag`` (unquoted)."""
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _link_or_copy(src: str, dest: str) -> None:
+    """Places ``src`` at ``dest`` (replacing it), sharing the data when possible."""
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+def build_book_pdf_cached(
+    book_data: dict, output_path: str, progress: BuildProgress | None = None, deadline_seconds: float | None = None
+) -> dict:
+    """``build_book_pdf`` through the whole-book result cache.
+
+    An unchanged book (same definition, same source versions) is served from
+    the cache without fetching or rendering anything. Successful results carry
+    the book's ``etag``. Books with degraded chapters or failed parts (an image
+    that couldn't be localized, a chapter that errored) are not cached, so the
+    next build tries again.
+    """
+    key = book_cache_key(book_data)
+    cached_path = book_cache.path(key) if key else None
+    if cached_path:
+        try:
+            _link_or_copy(cached_path, output_path)
+            logger.info(f"Serving cached book {key[:12]} for {book_data.get('title')}")
+            return {
+                "success": True,
+                "fileName": book_file_name(book_data),
+                "path": output_path,
+                "mimeType": "application/pdf",
+                "etag": key,
+                "cached": True,
+                "bytesSaved": (book_cache.meta(key) or {}).get("bytesSaved", 0),
+            }
+        except OSError as e:
+            # Evicted in the meantime; build it again
+            logger.warning(f"Cached book {key[:12]} unavailable: {e}")
+
+    result = build_book_pdf(book_data, output_path, progress, deadline_seconds=deadline_seconds)
+    if result.get("success") and not result.get("degradedChapters") and not result.get("incomplete"):
+        # The build refreshed every source, so the key is computable now
+        key = book_cache_key(book_data)
+        if key:
+            stored = None
+            try:
+                stored = book_cache.temp_path(".pdf")
+                _link_or_copy(output_path, stored)
+                book_cache.set_file(key, stored, {"title": book_data.get('title'), "bytesSaved": result.get("bytesSaved", 0)})
+                result["etag"] = key
+            except OSError as e:
+                # The book itself is fine; caching it is best-effort
+                logger.warning(f"Could not cache book {key[:12]}: {e}")
+                if stored:
+                    try:
+                        os.remove(stored)
+                    except OSError:
+                        pass
+    return result
+
+def generate_book_pdf(book_data: dict, deadline_seconds: float | None = None) -> dict:
+    """Generates a PDF for the book and returns it base64-encoded (JSON contract)."""
+    with tempfile.TemporaryDirectory() as out_dir:
+        final_pdf_path = os.path.join(out_dir, "book.pdf")
+        result = build_book_pdf_cached(book_data, final_pdf_path, deadline_seconds=deadline_seconds)
+        if not result.get("success"):
+            return result
+
+        # Read back
+        with open(final_pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+
+    with stage("base64"):
+        base64_content = base64.b64encode(pdf_bytes).decode('utf-8')
+
+    return {
+        "success": True,
+        "fileName": result["fileName"],
+        "content": base64_content,
+        "mimeType": "application/pdf",
+        "etag": result.get("etag"),
+        "bytesSaved": result.get("bytesSaved", 0),
+        "degradedChapters": result.get("degradedChapters", []),
+    }
+
+@stage("build_book")
+def build_book_pdf(
+    book_data: dict,
+    output_path: str,
+    progress: BuildProgress | None = None,
+    preview_pages: int | None = None,
+    deadline_seconds: float | None = None,
+) -> dict:
+    """Renders the book to ``output_path`` using the robust Fetch -> Clean -> Normalize pipeline.
+
+    ``progress``, if given, is updated as chapters, images and rendering advance.
+    All downloads of the build share a BOOK_MAX_DOWNLOAD_BYTES budget.
+
+    With ``preview_pages`` only the cover and the first that many pages of the
+    first chapter are rendered, images not in the image store become
+    placeholders and downloads share the much smaller PREVIEW_MAX_DOWNLOAD_BYTES.
+
+    With ``deadline_seconds`` (see BOOK_DEADLINE_SECONDS) fetches stop
+    BOOK_RENDER_RESERVE_SECONDS before it; previews always stop
+    PREVIEW_RENDER_RESERVE_SECONDS before PREVIEW_DEADLINE_SECONDS. Chapters
+    that aren't done by then lose their missing images, fall back to a stale
+    cached copy or become a placeholder; they are listed in the result's
+    ``degradedChapters``.
+    """
+    progress = progress or BuildProgress()
+    if preview_pages:
+        fetch_seconds = max(0.0, PREVIEW_DEADLINE_SECONDS - PREVIEW_RENDER_RESERVE_SECONDS)
+    elif deadline_seconds:
+        fetch_seconds = max(0.0, deadline_seconds - BOOK_RENDER_RESERVE_SECONDS)
+    else:
+        fetch_seconds = None
+    # Read by the fetch scheduler in every chapter/image worker (see in_context)
+    budget_token = book_budget.set(ByteBudget(PREVIEW_MAX_DOWNLOAD_BYTES if preview_pages else BOOK_MAX_DOWNLOAD_BYTES))
+    deadline_token = book_deadline.set(Deadline(fetch_seconds) if fetch_seconds is not None else None)
+    failures = []
+    failures_token = _build_failures.set(failures)
     try:
         try:
-            import ctypes.util
-            import os
-
-            original_find_library = ctypes.util.find_library
-
-            def patched_find_library(name: str):
-                lib_dir = os.environ.get("WEASYPRINT_LIB_DIR", "/app/.libs")
-                if lib_dir and os.path.isdir(lib_dir):
-                    direct = os.path.join(lib_dir, name)
-                    if os.path.exists(direct):
-                        return direct
-                    bases = [
-                        name,
-                        f"lib{name}",
-                        f"lib{name}-0",
-                        f"lib{name}-1",
-                        f"{name}-0",
-                        f"{name}-1",
-                    ]
-                    for base in bases:
-                        for suffix in ("", ".so", ".so.0", ".so.1", ".so.2"):
-                            candidate = os.path.join(lib_dir, f"{base}{suffix}")
-                            if os.path.exists(candidate):
-                                return candidate
-                    for fname in os.listdir(lib_dir):
-                        if name in fname:
-                            return os.path.join(lib_dir, fname)
-                return original_find_library(name)
-
-            ctypes.util.find_library = patched_find_library
-            from weasyprint import HTML
+            load_weasyprint()
         except Exception as e:
             logger.error(f"WeasyPrint import failed: {e}")
             return {"error": "PDF generation unavailable (WeasyPrint import failed).", "success": False}
@@ -267,34 +1019,33 @@ def generate_book_pdf(book_data: dict) -> dict:
         logger.info(f"Generating PDF for book: {book_data.get('title')}")
         
         chapters_data = book_data.get('chapters', [])
+        if preview_pages:
+            chapters_data = chapters_data[:1]
         
         # Use a temporary directory for the entire process
         with tempfile.TemporaryDirectory() as temp_dir:
-            processed_chapters = []
-            
-            for chapter in chapters_data:
-                url = chapter.get('url')
-                title = chapter.get('title', 'By Unknown')
-                
-                if not url:
-                    # Fallback to content if URL is missing
-                    if chapter.get('content'):
-                         processed_chapters.append(f"<h1>{title}</h1>\n<div>{chapter.get('content')}</div>")
-                    continue
+            # Chapters are independent, so fetch/clean/localize them on a
+            # book-wide pool; map() keeps the results in chapter order.
+            progress.start("chapters", len(chapters_data))
+            degraded = []
 
-                try:
-                    clean = fetch_clean(url)
-                    if clean:
-                        clean = repair_unicode(clean)
-                        clean = localize_images(clean, url, temp_dir)
-                        normalized = normalize_to_book_html(clean, title, temp_dir)
-                        processed_chapters.append(normalized)
-                    else:
-                        logger.warning(f"Empty content fetched for {url}")
-                except Exception as e:
-                    logger.error(f"Error processing chapter {title} ({url}): {e}")
-                    processed_chapters.append(f"<h1>{title}</h1>\n<p>Error processing content from {url}</p>")
+            def run_chapter(index, chapter):
+                # Each call runs in its own context copy (in_context), and so do
+                # the image downloads it starts
+                steps = []
+                _chapter_degradations.set(steps)
+                chapter_html = process_chapter(chapter, temp_dir, progress, preview_pages)
+                if steps:
+                    degraded.append({"index": index, "title": chapter.get('title'), "url": chapter.get('url'), "steps": steps})
+                progress.advance("chapters")
+                return chapter_html
 
+            workers = max(1, min(CHAPTER_WORKERS, len(chapters_data)))
+            with stage("chapters"), ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(in_context(run_chapter), range(len(chapters_data)), chapters_data))
+            processed_chapters = [chapter_html for chapter_html in results if chapter_html]
+            if degraded:
+                logger.warning(f"{len(degraded)} of {len(chapters_data)} chapters degraded for {book_data.get('title')}")
 
             # --- Cover Page Logic ---
             title_text = html.escape(book_data.get('title') or 'Untitled')
@@ -310,40 +1061,43 @@ def generate_book_pdf(book_data: dict) -> dict:
                     images_dir = os.path.join(temp_dir, "images")
                     os.makedirs(images_dir, exist_ok=True)
 
-                    # Hash filename
-                    ext = os.path.splitext(cover_image_url)[-1] or ".jpg"
-                    if '?' in ext:
-                        ext = ext.split('?')[0]
-                    name = hashlib.md5(cover_image_url.encode()).hexdigest() + ext
-                    path = os.path.join(images_dir, name)
-
-                    # Check if it's a local file path
-                    if os.path.isfile(cover_image_url):
-                        # Copy local file to temp images dir
-                        shutil.copy2(cover_image_url, path)
+                    # Cover generated and stored by /generate-cover/
+                    asset_name = cover_asset_name(cover_image_url)
+                    asset_path = cover_store.blob_path(asset_name) if asset_name else None
+                    if asset_name and not asset_path:
+                        logger.warning(f"Stored cover {asset_name} not found, fetching it by URL")
+
+                    # Local file path (or file:// URL)
+                    local_path = cover_image_url[7:] if cover_image_url.startswith('file://') else cover_image_url
+                    if asset_path and cover_store.link(asset_path, images_dir, asset_name):
+                        cover_image_url = f"images/{asset_name}"
+                    elif os.path.isfile(local_path):
+                        # Name by content so a changed file never reuses a cached cover render
+                        with open(local_path, "rb") as f:
+                            name = hashlib.sha256(f.read()).hexdigest() + image_ext(local_path)
+                        shutil.copy2(local_path, os.path.join(images_dir, name))
                         cover_image_url = f"images/{name}"
                     elif cover_image_url.startswith('file://'):
-                        # Handle file:// URLs
-                        local_path = cover_image_url[7:]
-                        if os.path.isfile(local_path):
-                            shutil.copy2(local_path, path)
-                            cover_image_url = f"images/{name}"
-                    elif not os.path.exists(path):
-                        # Download from URL (using fast session)
-                        content = download_image_fast(cover_image_url)
-                        if content:
-                            with open(path, "wb") as f:
-                                f.write(content)
-                            cover_image_url = f"images/{name}"
+                        logger.warning(f"Cover image file not found: {local_path}")
+                    else:
+                        # Remote cover: reuse the shared image store
+                        stored_name = localize_image_url(
+                            cover_image_url, images_dir, COVER_WIDTH_MM, cached_only=deadline_passed()
+                        )
+                        if stored_name:
+                            cover_image_url = f"images/{stored_name}"
                         else:
                             logger.warning(f"Failed to download cover image")
-                    else:
-                         cover_image_url = f"images/{name}"
+                            note_failed(cover_image_url)
 
                 except Exception as e:
                     logger.error(f"Error localizing cover image: {e}")
+                    note_failed(cover_image_url)
+                if not cover_image_url.startswith("images/"):
+                    # Not localized: fall back to the text-only cover
+                    cover_image_url = None
             
-            cover_options = book_data.get('coverOptions', {})
+            cover_options = book_data.get('coverOptions') or {}
             layout = cover_options.get('layout', 'center')
             font_family_opt = cover_options.get('fontFamily', 'serif')
             
@@ -366,52 +1120,6 @@ def generate_book_pdf(book_data: dict) -> dict:
                  if not cover_options.get('subtitleColor'): subtitle_color = '#eee'
                  if not cover_options.get('authorColor'): author_color = '#ddd'
 
-            final_pdf_path = os.path.join(temp_dir, "book.pdf")
-
-            # Combined HTML with cover as first page, then content
-            # Using @page for cover, named page for content
-            combined_css = f"""
-            @page cover {{
-                size: A4;
-                margin: 0;
-            }}
-            @page content {{
-                size: A4;
-                margin: 2cm;
-            }}
-            .cover-wrapper {{
-                page: cover;
-                position: relative;
-                width: 210mm;
-                height: 297mm;
-                overflow: hidden;
-                page-break-after: always;
-            }}
-            .cover-image {{
-                position: absolute;
-                top: 0;
-                left: 0;
-                width: 100%;
-                height: 100%;
-                object-fit: cover;
-            }}
-            .dark-overlay {{
-                position: absolute;
-                top: 0; left: 0; right: 0; bottom: 0;
-                background-color: rgba(0, 0, 0, 0.2);
-            }}
-            .title-page {{
-                position: absolute;
-                bottom: 0; left: 0; right: 0;
-                padding: 32px;
-                box-sizing: border-box;
-            }}
-            .content-section {{
-                page: content;
-            }}
-            {BOOK_CSS}
-            """
-
             # Build cover section
             cover_section = ""
             if cover_image_url:
@@ -441,42 +1149,64 @@ def generate_book_pdf(book_data: dict) -> dict:
                 </div>
                 """
 
-            # Combined HTML document
-            combined_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="utf-8">
-                <style>{combined_css}</style>
-            </head>
-            <body>
-                {cover_section}
-                <div class="content-section">
-                    {''.join(processed_chapters)}
-                </div>
-            </body>
-            </html>
-            """
-
-            # Single PDF render (faster than render + merge)
-            HTML(string=combined_html, base_url=temp_dir).write_pdf(
-                final_pdf_path,
-                presentational_hints=True
-            )
+            progress.start("rendering")
+            if BOOK_RENDER_MODE == "fragments" or preview_pages:
+                # Cover and chapters render (and cache) independently, so an edit
+                # only re-renders the sections whose HTML actually changed, and
+                # the ones that did render in parallel on the worker pool.
+                documents = [fragment_document(cover_section)]
+                for chapter_html in processed_chapters:
+                    section = f'<div class="content-section">{chapter_html}</div>'
+                    documents.append(fragment_document(section))
+                assemble_pdf(render_fragments(documents, temp_dir, preview_pages), output_path)
+            else:
+                # Combined HTML document
+                combined_html = f"""
+                <!DOCTYPE html>
+                <html>
+                <head>
+                    <meta charset="utf-8">
+                </head>
+                <body>
+                    {cover_section}
+                    <div class="content-section">
+                        {''.join(processed_chapters)}
+                    </div>
+                </body>
+                </html>
+                """
 
-            # Read back
-            with open(final_pdf_path, "rb") as f:
-                pdf_bytes = f.read()
-                
-            base64_content = base64.b64encode(pdf_bytes).decode('utf-8')
-            
-            return {
+                # Single PDF render
+                render_document(combined_html, output_path, temp_dir)
+
+            result = {
                 "success": True,
-                "fileName": f"{book_data.get('title', 'book').replace(' ', '-').lower()}.pdf",
-                "content": base64_content,
+                "fileName": book_file_name(book_data),
+                "path": output_path,
                 "mimeType": "application/pdf"
             }
+            if degraded:
+                result["degradedChapters"] = sorted(degraded, key=lambda chapter: chapter["index"])
+            if failures:
+                # Served as is, but the next build tries the missing parts again
+                logger.warning(f"{len(failures)} parts of {book_data.get('title')} failed: {', '.join(failures[:5])}")
+                result["incomplete"] = True
+            if preview_pages:
+                result["fileName"] = result["fileName"].removesuffix(".pdf") + "-preview.pdf"
+                result["preview"] = True
+            elif PDF_OPTIMIZE:
+                try:
+                    optimization = optimize_pdf(output_path)
+                    result["bytesSaved"] = optimization["bytesBefore"] - optimization["bytesAfter"]
+                except Exception as e:
+                    # The rendered PDF is still fine, just not optimized
+                    logger.warning(f"PDF optimization failed: {e}")
+            return result
         
     except Exception as e:
         logger.error(f"Error generating PDF: {e}")
         return {"error": str(e), "success": False}
+    finally:
+        _build_failures.reset(failures_token)
+        book_deadline.reset(deadline_token)
+        book_budget.reset(budget_token)
@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fetcher import HostQueueExecutor
+
+
+def test_busy_host_does_not_hold_up_other_hosts():
+    executor = HostQueueExecutor(max_workers=4, per_host=2)
+    started = time.monotonic()
+    slow = [executor.submit("slow.example", time.sleep, 0.2) for _ in range(10)]
+    fast = [executor.submit("fast.example", time.monotonic) for _ in range(4)]
+
+    assert max(future.result() for future in fast) - started < 0.1
+    for future in slow:
+        future.result()
+    # Two at a time: five rounds of 0.2 s
+    assert time.monotonic() - started >= 1.0
+
+
+def test_results_and_errors_reach_the_futures():
+    executor = HostQueueExecutor(max_workers=2, per_host=1)
+    ok = executor.submit("a.example", lambda x: x * 2, 21)
+    failed = executor.submit("a.example", lambda: 1 / 0)
+
+    assert ok.result() == 42
+    assert isinstance(failed.exception(), ZeroDivisionError)
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import lxml.html
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from images import is_decorative_image
+
+
+def _img(**attrs):
+    return lxml.html.Element("img", {key: str(value) for key, value in attrs.items()})
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/photos/beacon-hill-at-dusk.jpg",
+    "https://example.com/img/habit-tracker-template.png",
+    "https://example.com/img/eye-tracking-heatmap.png",
+    "https://example.com/img/covid-tracker-chart-2021.png",
+    "https://example.com/img/gps-tracking-results.png",
+    "https://example.com/img/1x1-interview.jpg",
+    "https://example.com/img/open-pixel-art.gif",
+    "https://example.com/img/clear.jpg",
+    "https://example.com/img/share-price-chart.png",
+    "https://pixel-photography.com/gallery/sunset.jpg",
+    "https://tracking.example.org/uploads/route-map.png",
+])
+def test_content_image_names_are_kept(url):
+    assert not is_decorative_image(_img(), url)
+
+
+@pytest.mark.parametrize("url, attrs", [
+    ("https://www.google-analytics.com/collect?v=1", {}),
+    ("https://stats.wp.com/g.gif?blog=1", {}),
+    ("https://www.facebook.com/tr?id=1&ev=PageView", {}),
+    ("https://example.com/tracking-pixel.gif", {"width": 1}),
+    ("https://example.com/spacer.gif", {"width": 10, "height": 10}),
+    ("https://example.com/img/beacon.png", {"width": 40, "height": 40}),
+    ("https://example.com/img/avatar-jane.jpg", {"width": 48, "height": 48}),
+    ("https://example.com/img/chart.png", {"class": "share-icon"}),
+])
+def test_tracking_and_decorative_images_are_dropped(url, attrs):
+    assert is_decorative_image(_img(**attrs), url)
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import jobs
+
+
+def test_prune_removes_expired_orphan_pdfs(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    old = time.time() - jobs.JOB_RESULT_TTL - 60
+    orphan = tmp_path / "orphan.pdf"
+    recent = tmp_path / "recent.pdf"
+    other = tmp_path / "notes.txt"
+    for path in (orphan, recent, other):
+        path.write_bytes(b"%PDF")
+    os.utime(orphan, (old, old))
+    os.utime(other, (old, old))
+
+    jobs.prune_finished_jobs()
+
+    assert not orphan.exists()
+    assert recent.exists()
+    assert other.exists()
+
+
+def test_prune_keeps_pdfs_of_known_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    job = jobs.BookJob({"title": "Kept", "chapters": []})
+    job.result_path = str(tmp_path / f"{job.id}.pdf")
+    job.status = "running"
+    with open(job.result_path, "wb") as f:
+        f.write(b"%PDF")
+    old = time.time() - jobs.JOB_RESULT_TTL - 60
+    os.utime(job.result_path, (old, old))
+    monkeypatch.setitem(jobs._jobs, job.id, job)
+
+    jobs.prune_finished_jobs()
+
+    assert os.path.exists(job.result_path)
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import renderer
+
+
+@pytest.fixture
+def weasyprint():
+    try:
+        return renderer.load_weasyprint()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+
+
+def _image_count(pdf_path: str) -> int:
+    from pypdf import PdfReader
+
+    return sum(len(page.images) for page in PdfReader(pdf_path).pages)
+
+
+def test_write_pdf_embeds_local_image(weasyprint, tmp_path):
+    from PIL import Image
+
+    Image.new("RGB", (64, 48), "teal").save(tmp_path / "photo.png")
+    document = renderer.fragment_document('<p>Local</p><img src="photo.png">')
+    output = str(tmp_path / "out.pdf")
+
+    renderer._write_pdf(document, f"{tmp_path}/", output)
+
+    assert _image_count(output) == 1
+
+
+def test_write_pdf_skips_remote_image(weasyprint, tmp_path):
+    document = renderer.fragment_document('<p>Remote</p><img src="https://example.com/a.png">')
+    output = str(tmp_path / "out.pdf")
+
+    renderer._write_pdf(document, f"{tmp_path}/", output)
+
+    assert os.path.getsize(output) > 0
+    assert _image_count(output) == 0
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import lxml.html
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import services
+
+
+def test_failed_image_is_recorded_as_build_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(services, "localize_image_url", lambda *args, **kwargs: None)
+    tree = lxml.html.fromstring('<div><p>Text</p><img src="https://example.com/photo.jpg" width="800"></div>')
+    failures = []
+    token = services._build_failures.set(failures)
+    try:
+        services.localize_images(tree, "https://example.com/article", str(tmp_path))
+    finally:
+        services._build_failures.reset(token)
+
+    assert failures == ["https://example.com/photo.jpg"]
+    assert tree.find(".//img") is None
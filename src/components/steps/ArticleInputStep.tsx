@@ -55,6 +55,7 @@ const ArticleInputStep: React.FC = () => {
                 description: summary,
                 content: result.content,
                 media: result.media, // Assuming media contains an image URL if available
+                articleId: result.articleId,
                 isLoading: false
               });
               
@@ -28,7 +28,7 @@ const PreviewDownloadStep: React.FC = () => {
 
             // Call the Python backend to generate the book
             const backendUrl = import.meta.env.VITE_BACKEND_BASE_URL || 'http://localhost:8000';
-            const response = await fetch(`${backendUrl.replace(/\/$/, '')}/generate-book/`, {
+            const response = await fetch(`${backendUrl.replace(/\/$/, '')}/generate-book/pdf`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -43,26 +43,21 @@ const PreviewDownloadStep: React.FC = () => {
                  throw new Error(errorData.detail || 'Failed to generate book');
             }
 
-            const data = await response.json();
+            // The PDF comes back as a binary stream; take the file name from Content-Disposition
+            const disposition = response.headers.get('Content-Disposition') || '';
+            const fileNameMatch = disposition.match(/filename="?([^";]+)"?/);
+            const fileName = fileNameMatch
+                ? fileNameMatch[1]
+                : `${(state.book.title || 'book').replace(/ /g, '-').toLowerCase()}.pdf`;
 
-            if (!data.success) {
-                throw new Error('Failed to generate book');
-            }
-
-            console.log('Book generated successfully:', data);
+            const blob = await response.blob();
+            console.log('Book generated successfully:', fileName, blob.size);
 
-            // Convert base64 content back to blob and download
-            const binaryString = atob(data.content);
-            const bytes = new Uint8Array(binaryString.length);
-            for (let i = 0; i < binaryString.length; i++) {
-                bytes[i] = binaryString.charCodeAt(i);
-            }
-            const blob = new Blob([bytes], { type: data.mimeType });
             const url = URL.createObjectURL(blob);
             
             const element = document.createElement('a');
             element.href = url;
-            element.download = data.fileName;
+            element.download = fileName;
             document.body.appendChild(element);
             element.click();
             document.body.removeChild(element);
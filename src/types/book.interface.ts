@@ -7,6 +7,7 @@ export interface Chapter {
   url: string;
   content?: string;
   media?: Media[];
+  articleId?: string;
   isLoading?: boolean;
   error?: string;
 }
@@ -10,7 +10,8 @@ export const fetchArticleContent = async (
   url: string,
   retryCount = 0
 ): Promise<
-  { content: string; media: Media[]; title?: string } | { error: string }
+  | { content: string; media: Media[]; title?: string; articleId?: string }
+  | { error: string }
 > => {
   try {
     console.log(`Attempting to fetch article content from: ${url}`);
@@ -41,6 +42,7 @@ export const fetchArticleContent = async (
       content: data.content || '',
       media: data.media || [],
       title: data.title,
+      articleId: data.articleId || undefined,
     };
   } catch (error) {
     console.error(`Error fetching article (attempt ${retryCount + 1}):`, error);